@@ -0,0 +1,163 @@
+# Parses and checks many .xmodel_export files in parallel, outside of the Blender UI.
+#
+# python -m io_scene_xmodel.batch assets/ "more/**/*.xmodel_export" --jobs 8 --report report.json
+# python -m io_scene_xmodel.batch assets/ --fail-fast    (for CI: exits 1 at the first bad file)
+#
+# Inside Blender files that pass can also be imported and written back out:
+#
+# blender --background --python-expr "from io_scene_xmodel import batch; batch.main()" -- assets/ --export-dir out/
+
+import argparse
+import functools
+import glob
+import json
+import os
+import sys
+import time
+
+from . import cache
+from . import parser
+from . import records
+from . import validate
+from . import workers
+
+def find_files(patterns):
+    files = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.xmodel_export"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        for path in sorted(matches):
+            path = os.path.abspath(path)
+            if not path in seen:
+                seen.add(path)
+                files.append(path)
+    return files
+
+def process_file(path, cache_dir=None, fail_fast=False):
+    result = {
+        "path": path,
+        "ok": False,
+        "error": None,
+        "problems": [],
+        "seconds": 0.0,
+    }
+    start = time.perf_counter()
+    try:
+        if cache_dir is None:
+            p = parser.Parser()
+            p.read_file(path)
+        else:
+            p = cache.read_file(path, cache_dir)
+        result.update(
+            bones=len(p.bones),
+            vertices=len(p.positions),
+            faces=len(p.face_loop_start),
+            objects=len(p.objects),
+            materials=len(p.materials),
+        )
+        # warnings only fail a file with fail_fast
+        problems = validate.validate(p, fail_fast)
+        validate.locate(path, problems)
+        result["problems"] = [x.to_dict() for x in problems]
+        if fail_fast:
+            failed = problems
+        else:
+            failed = [x for x in problems if x.severity == validate.ERROR]
+        if failed:
+            result["error"] = "; ".join(str(x) for x in failed)
+        else:
+            result["ok"] = True
+    except records.ParseError as e:
+        result["problems"] = [{"check": "parse", "severity": validate.ERROR, "message": e.message, "count": 1, "line": e.line}]
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, str(e))
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def run(files, jobs=None, cache_dir=None, fail_fast=False):
+    # with fail_fast the run stops at the first file that fails
+    # jobs 0 or None means one worker per cpu
+    work = functools.partial(process_file, cache_dir=cache_dir, fail_fast=fail_fast)
+    jobs = workers.count(jobs)
+    if jobs == 1 or len(files) <= 1:
+        results = map(work, files)
+        return collect(results, fail_fast)
+    # --export-dir runs this inside Blender, see workers.py
+    pool = workers.executor(jobs)
+    try:
+        results = pool.map(work, files, chunksize=1 if fail_fast else max(1, len(files) // (4 * jobs)))
+        return collect(results, fail_fast)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def collect(results, fail_fast=False):
+    done = []
+    for r in results:
+        done.append(r)
+        if fail_fast and not r["ok"]:
+            break
+    return done
+
+def convert(path, out_dir):
+    # imports the file with the add-on operator and writes it back out, Blender only
+    import bpy
+    from . import export
+
+    bpy.ops.wm.read_homefile(use_empty=True)
+    bpy.ops.import_scene.xmodel_export(filepath=path)
+    for o in bpy.data.objects:
+        o.select_set(True)
+    out = os.path.join(out_dir, os.path.basename(path))
+    export.Exporter().export_file(out)
+    return out
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    ap = argparse.ArgumentParser(description="Batch parse and check .xmodel_export files")
+    ap.add_argument("inputs", nargs="+", help="files, directories or glob patterns")
+    ap.add_argument("--jobs", "-j", type=int, default=0, help="worker processes, 0 (the default) uses one per cpu and 1 checks everything in this process")
+    ap.add_argument("--report", help="write a JSON report with per-file timings and failures")
+    ap.add_argument("--cache-dir", help="read and fill the binary parse cache in this directory")
+    ap.add_argument("--fail-fast", action="store_true", help="fail files on any problem, not only errors, and stop at the first one")
+    ap.add_argument("--export-dir", help="import and re-export each good file into this directory (Blender only)")
+    args = ap.parse_args(argv)
+
+    files = find_files(args.inputs)
+    start = time.perf_counter()
+    results = run(files, args.jobs, args.cache_dir, args.fail_fast)
+
+    if args.export_dir:
+        os.makedirs(args.export_dir, exist_ok=True)
+        for r in results:
+            if not r["ok"]:
+                continue
+            t = time.perf_counter()
+            try:
+                r["exported"] = convert(r["path"], args.export_dir)
+            except Exception as e:
+                r["ok"] = False
+                r["error"] = "export %s: %s" % (type(e).__name__, str(e))
+            r["export_seconds"] = time.perf_counter() - t
+
+    elapsed = time.perf_counter() - start
+    failed = [r for r in results if not r["ok"]]
+    for r in results:
+        print("%-6s %8.3fs  %s%s" % ("ok" if r["ok"] else "FAIL", r["seconds"], r["path"], "" if r["ok"] else "  (%s)" % (r["error"])))
+    print("%d files, %d failed, %.2fs (%.1f files/s)" % (len(results), len(failed), elapsed, len(results) / elapsed if elapsed > 0 else 0.0))
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({
+                "jobs": workers.count(args.jobs),
+                "seconds": elapsed,
+                "files": results,
+            }, f, indent=1)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
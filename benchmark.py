@@ -0,0 +1,257 @@
+# Benchmarks for the parser, importer and exporter.
+#
+# python -m io_scene_xmodel.benchmark --vertices 100000 --triangles 200000 --json bench.json
+# python -m io_scene_xmodel.benchmark model.xmodel_export --shlex
+#
+# Without a file a synthetic one is generated from the size options. The mesh
+# build, weight, uv/normal and export stages need bpy and only run in Blender:
+#
+# blender --background --python-expr "from io_scene_xmodel import benchmark; benchmark.main()" -- --json bench.json
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+import numpy as np
+
+from . import dedup
+from . import parser
+from . import records
+from . import synthetic
+
+class ShlexParser(parser.Parser):
+    # the read_file loop as it was before parser.tokenize, kept as the baseline
+    def read_file(self, path):
+        self.filepath = path
+        reader = records.Reader()
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+            for l in lines:
+                if len(l) == 0:
+                    continue
+                if l[0] == '/' and l[1] == '/':
+                    continue
+                sp = shlex.split(l.strip(), posix=False)
+                if len(sp) == 0:
+                    continue
+
+                key = sp[0]
+                args = sp[1:]
+                parsers = reader.handlers
+                if key in parsers:
+                    parsers[key](*args)
+                self.add_records(reader.out)
+                reader.out.clear()
+        self.add_records(reader.close())
+        self.finish()
+
+def max_rss():
+    if resource is None:
+        return None
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r if sys.platform == "darwin" else r * 1024
+
+def count_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for l in f)
+
+def tokenize_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for l in f:
+            parser.tokenize(l)
+
+def read_file(cls, path):
+    p = cls()
+    p.read_file(path)
+    return p
+
+class Report():
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds, items, unit, peak_bytes=None):
+        self.stages[name] = {
+            "seconds": seconds,
+            "items": items,
+            "unit": unit,
+            "per_second": items / seconds if seconds > 0 else None,
+            "peak_bytes": peak_bytes,
+            "max_rss_bytes": max_rss(),
+        }
+
+    def run(self, name, items, unit, repeat, fn, *args, trace=False):
+        # best of repeat runs, then one more under tracemalloc for the peak
+        best = None
+        result = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        peak = None
+        if trace:
+            tracemalloc.start()
+            fn(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.add(name, best, items, unit, peak)
+        return result
+
+    def timed(self, name, items, unit, fn, *args):
+        # single run, for stages that change the Blender scene
+        start = time.perf_counter()
+        result = fn(*args)
+        self.add(name, time.perf_counter() - start, items, unit)
+        return result
+
+def bench_blender(report, p, export_path):
+    import bpy
+    from . import export
+    from . import operators
+
+    bpy.ops.wm.read_homefile(use_empty=True)
+    amt_ob, bone_names = report.timed("armature", len(p.bones), "bones", operators.build_armature, p)
+
+    build = 0.0
+    weights = 0.0
+    loop_data = 0.0
+    for o in p.objects:
+        start = time.perf_counter()
+        used, loop_verts, loop_totals, loops = operators.object_arrays(p, o, dedup.DEFAULT_EPSILON)
+        mesh = bpy.data.meshes.new(o.name)
+        operators.build_mesh(mesh, p.positions[used], loop_verts, loop_totals)
+        obj = bpy.data.objects.new(o.name, mesh)
+        obj.parent = amt_ob
+        mod = obj.modifiers.new("Rig", "ARMATURE")
+        mod.object = amt_ob
+        bpy.context.collection.objects.link(obj)
+        build += time.perf_counter() - start
+
+        start = time.perf_counter()
+        operators.assign_weights(obj, p, used, bone_names)
+        weights += time.perf_counter() - start
+
+        start = time.perf_counter()
+        operators.set_loop_data(mesh, parser.convert_uvs(p.loop_uvs[loops]), p.loop_normals[loops])
+        loop_data += time.perf_counter() - start
+    report.add("mesh_build", build, len(p.face_loop_start), "faces")
+    report.add("weights", weights, len(p.weight_bones), "influences")
+    report.add("uv_normals", loop_data, len(p.loop_vertices), "loops")
+
+    for obj in bpy.data.objects:
+        obj.select_set(True)
+    report.timed("export", len(p.face_loop_start), "faces", export.Exporter().export_file, export_path)
+
+def run(path, repeat=1, shlex_baseline=False, trace=True):
+    report = Report()
+    lines = count_lines(path)
+    report.run("tokenize", lines, "lines", repeat, tokenize_file, path, trace=trace)
+    p = report.run("parse", lines, "lines", repeat, read_file, parser.Parser, path, trace=trace)
+    report.add("semantic", max(0.0, report.stages["parse"]["seconds"] - report.stages["tokenize"]["seconds"]), lines, "lines")
+    if shlex_baseline:
+        report.run("parse_shlex", lines, "lines", repeat, read_file, ShlexParser, path)
+
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+    if bpy is not None:
+        fd, export_path = tempfile.mkstemp(suffix=".xmodel_export")
+        os.close(fd)
+        try:
+            bench_blender(report, p, export_path)
+        finally:
+            os.remove(export_path)
+
+    return {
+        "file": {
+            "path": path,
+            "bytes": os.path.getsize(path),
+            "lines": lines,
+            "bones": len(p.bones),
+            "vertices": len(p.positions),
+            "faces": len(p.face_loop_start),
+            "influences": len(p.weight_bones),
+            "objects": len(p.objects),
+            "materials": len(p.materials),
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "blender": None if bpy is None else ".".join(str(v) for v in bpy.app.version),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": report.stages,
+    }
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    ap = argparse.ArgumentParser(description="Benchmark parsing, importing and exporting .xmodel_export files")
+    ap.add_argument("files", nargs="*", help="files to benchmark, a synthetic file is generated when empty")
+    ap.add_argument("--bones", type=int, default=64)
+    ap.add_argument("--vertices", type=int, default=10000)
+    ap.add_argument("--triangles", type=int, default=20000)
+    ap.add_argument("--influences", type=int, default=4, help="bone influences per vertex")
+    ap.add_argument("--objects", type=int, default=1)
+    ap.add_argument("--materials", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=1, help="runs of the parser stages, the best one is reported")
+    ap.add_argument("--shlex", action="store_true", help="also time the old shlex based parser")
+    ap.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak measurement")
+    ap.add_argument("--json", help="write the results to this file")
+    args = ap.parse_args(argv)
+
+    results = []
+    if args.files:
+        for path in args.files:
+            results.append(run(path, args.repeat, args.shlex, not args.no_memory))
+    else:
+        config = {
+            "bones": args.bones,
+            "vertices": args.vertices,
+            "triangles": args.triangles,
+            "influences": args.influences,
+            "objects": args.objects,
+            "materials": args.materials,
+            "seed": args.seed,
+        }
+        fd, path = tempfile.mkstemp(suffix=".xmodel_export")
+        os.close(fd)
+        try:
+            synthetic.generate(path, **config)
+            r = run(path, args.repeat, args.shlex, not args.no_memory)
+            r["synthetic"] = config
+            results.append(r)
+        finally:
+            os.remove(path)
+
+    for r in results:
+        f = r["file"]
+        print("%s: %d lines, %d bones, %d vertices, %d faces, %d objects" % (
+            f["path"], f["lines"], f["bones"], f["vertices"], f["faces"], f["objects"]))
+        for name, s in r["stages"].items():
+            peak = "" if s["peak_bytes"] is None else "  peak %.1f MB" % (s["peak_bytes"] / 1e6)
+            print("  %-12s %8.3fs %12.0f %s/s%s" % (name, s["seconds"], s["per_second"] or 0, s["unit"], peak))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
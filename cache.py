@@ -0,0 +1,86 @@
+# Binary sidecar cache of parsed .xmodel_export files.
+#
+# Entries are Parser.save_binary files named after the source path, mtime and
+# size, so an edited source simply misses and its old entry ages out. Hits are
+# memory mapped and bump the entry's mtime, which drives least recently used
+# eviction once the directory grows past max_bytes.
+
+import hashlib
+import os
+import tempfile
+
+from . import parser
+from . import profiling
+
+DEFAULT_MAX_BYTES = 1 << 30
+SUFFIX = ".xmodelc"
+
+def default_cache_dir():
+    path = os.environ.get("XMODEL_CACHE_DIR")
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "io_scene_xmodel")
+
+def entry_path(path, cache_dir):
+    st = os.stat(path)
+    key = "%s\0%d\0%d\0%d" % (os.path.abspath(path), st.st_mtime_ns, st.st_size, parser.BINARY_VERSION)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + SUFFIX)
+
+def evict(cache_dir, max_bytes):
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(SUFFIX):
+            continue
+        full = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(full)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, full))
+        total += st.st_size
+    entries.sort()
+    for mtime, size, full in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(full)
+            total -= size
+        except OSError: # still mapped somewhere (Windows) or already gone
+            pass
+
+def store(p, entry, cache_dir, max_bytes):
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=cache_dir)
+    os.close(fd)
+    try:
+        p.save_binary(tmp)
+        os.replace(tmp, entry)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict(cache_dir, max_bytes)
+
+def read_file(path, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+    # returns a Parser for path, memory mapped from the cache when possible
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    entry = entry_path(path, cache_dir)
+    p = parser.Parser()
+    if os.path.exists(entry):
+        try:
+            with profiling.stage("cache_load"):
+                p.load_binary(entry)
+            p.filepath = path
+            os.utime(entry)
+            return p
+        except Exception:
+            p = parser.Parser()
+    p.read_file(path)
+    try:
+        with profiling.stage("cache_store"):
+            store(p, entry, cache_dir, max_bytes)
+    except OSError as e:
+        print("Could not write xmodel cache %s: %s" % (entry, str(e)))
+    return p
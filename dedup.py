@@ -0,0 +1,87 @@
+# Vertex deduplication shared by the importer and the exporter.
+#
+# Vertices are keyed on any mix of position, normal, uv and bone weights,
+# snapped to a grid of size epsilon, and rows with equal keys are merged.
+# Values closer than epsilon can still land in neighbouring cells, the grid
+# only makes the comparison tolerant to print/parse round-off.
+
+import numpy as np
+
+DEFAULT_EPSILON = 1e-5
+
+def quantize(values, epsilon=DEFAULT_EPSILON):
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    if epsilon <= 0:
+        return values.view(np.int64)
+    return np.round(values / epsilon).astype(np.int64)
+
+def weight_table(offsets, bones, weights, epsilon=DEFAULT_EPSILON):
+    # CSR weights -> one row per vertex of (bone, weight) pairs sorted by bone,
+    # padded with -1 so vertices with equal influences get equal rows
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    n = len(counts)
+    width = int(counts.max()) if n else 0
+    if width == 0:
+        return np.full((n, 0), -1, dtype=np.int64)
+    rows = np.repeat(np.arange(n), counts)
+    rank = np.arange(len(rows)) - np.repeat(offsets[:-1], counts)
+    pad = np.iinfo(np.int64).max
+    table_bones = np.full((n, width), pad, dtype=np.int64)
+    table_bones[rows, rank] = bones
+    table_weights = np.full((n, width), -1, dtype=np.int64)
+    table_weights[rows, rank] = quantize(weights, epsilon)[:, 0]
+    order = np.argsort(table_bones, axis=1, kind="stable")
+    table_bones = np.take_along_axis(table_bones, order, axis=1)
+    table_bones[table_bones == pad] = -1
+    table_weights = np.take_along_axis(table_weights, order, axis=1)
+    return np.stack((table_bones, table_weights), axis=2).reshape(n, 2 * width)
+
+def row_hashes(keys):
+    # FNV-1a style mix of the columns into one 64 bit value per row
+    h = np.full(len(keys), 0xcbf29ce484222325, dtype=np.uint64)
+    prime = np.uint64(0x100000001b3)
+    for column in keys.T:
+        h ^= column.astype(np.uint64)
+        h *= prime
+    return h
+
+def unique_rows(keys):
+    # first occurrence of every distinct row, in input order, and the index
+    # into those for every row
+    keys = np.ascontiguousarray(keys)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    _, first, inverse = np.unique(row_hashes(keys), return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    if not np.array_equal(keys[first[inverse]], keys):
+        # hash collision, compare the rows themselves
+        rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    return first[order], remap[inverse]
+
+def dedup(positions, normals=None, uvs=None, weights=None, epsilon=DEFAULT_EPSILON):
+    # weights is a (offsets, bones, values) CSR tuple; returns unique_rows() of
+    # the combined key
+    columns = [quantize(positions, epsilon)]
+    if normals is not None:
+        columns.append(quantize(normals, epsilon))
+    if uvs is not None:
+        columns.append(quantize(uvs, epsilon))
+    if weights is not None:
+        columns.append(weight_table(*weights, epsilon=epsilon))
+    return unique_rows(np.hstack(columns))
+
+def distinct_corners(corner_vertices, corner_totals):
+    # number of distinct (face, vertex) pairs, corner_vertices lists the corners
+    # face after face. A merge that lowers it collapses some face
+    faces = np.repeat(np.arange(len(corner_totals)), corner_totals)
+    n = int(corner_vertices.max()) + 1 if len(corner_vertices) else 1
+    pairs = np.sort(faces * n + corner_vertices)
+    return int(len(pairs) > 0) + int(np.count_nonzero(pairs[1:] != pairs[:-1]))
@@ -1,7 +1,13 @@
 import bpy
-import os
-import mathutils
-import bmesh
+
+import numpy as np
+
+from . import profiling
+from . import dedup
+from . import formatting
+from . import influences
+from .formatting import BlockWriter
+from .sections import MeshWriter, SectionCache
 
 def get_selected_objects():
     selected_objects = [o for o in bpy.context.scene.objects if o.select_get()]
@@ -24,149 +30,342 @@ def get_meshes():
         meshes.append(o)
     return meshes
 
-class Exporter():
+# https://blender.stackexchange.com/questions/80773/how-to-get-the-name-of-image-of-image-texture-with-python
+def get_image(material):
+    if material.use_nodes:
+        for n in material.node_tree.nodes:
+            if n.type == 'TEX_IMAGE' and n.image is not None:
+                # the image name as before, file paths may be relative to the
+                # .blend ("//") or point into the artist's machine
+                return n.image.name
+    return ""
+
+class MaterialTable():
+    # the MATERIAL entries of one export, one per distinct material and image
+    # name written. Node trees are scanned once per material
     def __init__(self):
-        pass
+        self.entries = [] # (name, image name)
+        self.index = {}
+        self.images = {} # material name: image name written
+    
+    def add(self, material):
+        if material is None:
+            key = None
+        else:
+            if not material.name in self.images:
+                self.images[material.name] = get_image(material)
+            key = (material.name, self.images[material.name])
+        if not key in self.index:
+            self.index[key] = len(self.entries)
+            self.entries.append(key if key is not None else ("material_%d" % (len(self.entries)), ""))
+        return self.index[key]
+    
+    def slots(self, ob):
+        # entry index of every material slot of ob
+        slots = [self.add(s.material) for s in ob.material_slots] or [self.add(None)]
+        return np.array(slots, dtype=np.int32)
+    
+    def faces(self, ob, me, slots):
+        # entry index of every loop triangle of the evaluated mesh me of ob
+        indices = np.empty(len(me.polygons), dtype=np.int32)
+        me.polygons.foreach_get("material_index", indices)
+        polygons = np.empty(len(me.loop_triangles), dtype=np.int32)
+        me.loop_triangles.foreach_get("polygon_index", polygons)
+        return slots[np.clip(indices, 0, len(slots) - 1)][polygons]
+
+class Skeleton():
+    # the bones written to the file: names, parent indices and world space
+    # matrices (n, 4, 4). armature is the object they come from, None for the
+    # one bone skeleton used when no armature is selected
+    def __init__(self, names, parents, matrices, armature=None):
+        self.names = names
+        self.parents = parents
+        self.matrices = matrices
+        self.armature = armature
+        self.table = {name: index for index, name in enumerate(names)}
+
+def armature_skeleton(amt_ob):
+    # rest pose of the bones, which are listed parents first
+    bones = amt_ob.data.bones
+    names = [b.name for b in bones]
+    table = {name: index for index, name in enumerate(names)}
+    parents = [-1 if b.parent is None else table[b.parent.name] for b in bones]
+    local = np.empty(len(bones) * 16, dtype=np.float32)
+    bones.foreach_get("matrix_local", local)
+    # foreach_get hands out matrices column by column
+    local = local.reshape(-1, 4, 4).transpose(0, 2, 1)
+    matrices = np.matmul(np.array(amt_ob.matrix_world, dtype=np.float32), local)
+    return Skeleton(names, parents, matrices, amt_ob)
+
+def origin_skeleton():
+    # stands in for a missing armature without adding one to the scene, every
+    # vertex is weighted fully to its single bone
+    return Skeleton(["tag_origin"], [-1], np.eye(4, dtype=np.float32).reshape(1, 4, 4))
+
+def pose_matrices(amt_ob):
+    # (n, 4, 4) armature space deformation of every bone, pose times inverse rest
+    bones = amt_ob.data.bones
+    rest = np.empty(len(bones) * 16, dtype=np.float32)
+    bones.foreach_get("matrix_local", rest)
+    pose = np.empty(len(bones) * 16, dtype=np.float32)
+    amt_ob.pose.bones.foreach_get("matrix", pose)
+    rest = rest.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+    pose = pose.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+    return np.matmul(pose, np.linalg.inv(rest))
+
+def posed_armature(ob):
+    # the Armature modifier that poses ob, None when the evaluated mesh already
+    # is in rest pose. The bones are written in rest pose, so the deformation of
+    # that modifier is undone on the evaluated mesh (see unpose) rather than
+    # switching the armature to Rest Position, which would change shared data
+    modifiers = [m for m in ob.modifiers if m.show_viewport]
+    posed = []
+    for m in modifiers:
+        if m.type != 'ARMATURE' or m.object is None or m.object.type != 'ARMATURE':
+            continue
+        if m.object.data.pose_position == 'REST':
+            continue
+        if np.allclose(pose_matrices(m.object), np.eye(4), atol=1e-6):
+            continue
+        posed.append(m)
+    if not posed:
+        return None
+    m = posed[0]
+    bbones = any(b.use_deform and b.bbone_segments > 1 for b in m.object.data.bones)
+    if len(posed) > 1 or modifiers[-1] != m or not m.use_vertex_groups or m.use_bone_envelopes \
+            or m.use_deform_preserve_volume or m.use_multi_modifier or m.vertex_group or bbones:
+        # only a plain vertex group deformation at the end of the stack can be undone
+        raise Exception("%s is deformed by the posed armature %s, set it to Rest Position to export" % (ob.name, m.object.name))
+    return m
+
+def unpose(ob, m, groups, co, normals, vertex_index):
+    # undoes the linear blend skinning of the Armature modifier m: every vertex
+    # was moved by the weighted mean of its bones' matrices, in the space of ob
+    amt_ob = m.object
+    table = {b.name: i for i, b in enumerate(amt_ob.data.bones) if b.use_deform}
+    (offsets, bones, weights), unweighted = influences.from_groups(*groups, [table.get(g.name, -1) for g in ob.vertex_groups])
+    space = np.linalg.inv(np.array(amt_ob.matrix_world, dtype=np.float64)) @ np.array(ob.matrix_world, dtype=np.float64)
+    deform = np.linalg.inv(space) @ pose_matrices(amt_ob) @ space
+    counts = np.diff(offsets)
+    rows = np.repeat(np.arange(len(co)), counts)
+    contrib = np.bincount(rows, weights, minlength=len(co))
+    blend = deform[bones].reshape(-1, 16) * weights[:, None]
+    a = np.stack([np.bincount(rows, blend[:, k], minlength=len(co)) for k in range(16)], axis=1).reshape(-1, 4, 4)
+    # like Blender, vertices with (almost) no weight are left where they are
+    moved = contrib > 1e-4
+    a[moved] /= contrib[moved, None, None]
+    a[~moved] = np.eye(4)
+    rest = np.linalg.solve(a[:, :3, :3], (co - a[:, :3, 3])[:, :, None])[:, :, 0]
+    # normals went through the inverse transpose, back with the transpose
+    n = np.einsum("lji,lj->li", a[vertex_index, :3, :3], normals)
+    length = np.linalg.norm(n, axis=1, keepdims=True)
+    return rest.astype(np.float32), (n / np.where(length > 0, length, 1.0)).astype(np.float32)
+
+def transform(co, normals, matrix):
+    # positions and normals to world space with one multiplication each,
+    # normals with the inverse transpose so scaled meshes keep them upright
+    m = np.array(matrix, dtype=np.float64)
+    co = (co @ m[:3, :3].T + m[:3, 3]).astype(np.float32)
+    n = normals @ np.linalg.inv(m[:3, :3])
+    length = np.linalg.norm(n, axis=1, keepdims=True)
+    normals = (n / np.where(length > 0, length, 1.0)).astype(np.float32)
+    return co, normals
+
+def get_mesh_arrays(ob, me, posed=None):
+    # me is ob evaluated with its modifiers, written as its loop triangles in
+    # world space. Every face of the result is a triangle. posed is the
+    # (Armature modifier, vertex groups) of a posed mesh, which is unposed first
+    nv = len(me.vertices)
+    nl = len(me.loops)
+    nt = len(me.loop_triangles)
+    
+    co = np.empty(nv * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    if hasattr(me, "calc_normals_split"): # removed in Blender 4.1, where corner normals are always current
+        me.calc_normals_split()
+    normals = np.empty(nl * 3, dtype=np.float32)
+    me.loops.foreach_get("normal", normals)
+    vertex_index = np.empty(nl, dtype=np.int32)
+    me.loops.foreach_get("vertex_index", vertex_index)
+    
+    if me.uv_layers.active is None:
+        raise Exception("No UV map for %s" % (ob.name))
+    uvs = np.empty(nl * 2, dtype=np.float32)
+    me.uv_layers.active.data.foreach_get("uv", uvs)
+    
+    tris = np.empty(nt * 3, dtype=np.int32)
+    me.loop_triangles.foreach_get("loops", tris)
+    tris = tris.reshape(-1, 3)
+    if ob.matrix_world.determinant() < 0:
+        # mirrored, the corners are reversed to keep the faces pointing out
+        tris = tris[:, ::-1]
+    tris = tris.ravel()
+    
+    co = co.reshape(-1, 3)
+    normals = normals.reshape(-1, 3)
+    if posed is not None:
+        co, normals = unpose(ob, posed[0], posed[1], co, normals, vertex_index)
+    co, normals = transform(co, normals, ob.matrix_world)
+    loop_starts = np.arange(0, nt * 3, 3, dtype=np.int32)
+    loop_totals = np.full(nt, 3, dtype=np.int32)
+    return co, normals[tris], vertex_index[tris], loop_starts, loop_totals, uvs.reshape(-1, 2)[tris]
+
+def origin_weights(n):
+    return np.arange(n + 1, dtype=np.int64), np.zeros(n, dtype=np.int64), np.ones(n, dtype=np.float64)
+
+def get_groups(me):
+    # vertex group memberships of every vertex as (counts, groups, weights).
+    # They have no foreach_get, so this is the one per vertex loop left and it
+    # only copies two numbers each
+    counts = []
+    groups = []
+    weights = []
+    for v in me.vertices:
+        vgroups = v.groups
+        counts.append(len(vgroups))
+        for vg in vgroups:
+            groups.append(vg.group)
+            weights.append(vg.weight)
+    return counts, groups, weights
+
+def get_vertex_weights(ob, groups, table, max_influences=0):
+    # bone influences of every vertex as (offsets, bones, weights), and the
+    # vertices that have none
+    group_bones = [table.get(gr.name, -1) for gr in ob.vertex_groups]
+    vw, unweighted = influences.from_groups(*groups, group_bones)
+    return influences.limit(*vw, max_influences), unweighted
+
+section_cache = SectionCache()
+
+@bpy.app.handlers.persistent
+def track_updates(scene, depsgraph):
+    for u in depsgraph.updates:
+        if u.is_updated_geometry or u.is_updated_transform:
+            section_cache.dirty.add((u.id.id_type, u.id.original.name))
+
+@bpy.app.handlers.persistent
+def forget_updates(*args):
+    section_cache.everything = True
+
+HANDLERS = (
+    (bpy.app.handlers.depsgraph_update_post, track_updates),
+    (bpy.app.handlers.undo_post, forget_updates),
+    (bpy.app.handlers.redo_post, forget_updates),
+    (bpy.app.handlers.load_post, forget_updates),
+)
+
+def register():
+    for handlers, f in HANDLERS:
+        if not f in handlers:
+            handlers.append(f)
+    section_cache.tracking = True
+    section_cache.everything = True
+
+def unregister():
+    section_cache.tracking = False
+    for handlers, f in HANDLERS:
+        if f in handlers:
+            handlers.remove(f)
+
+class Exporter(MeshWriter):
+    def __init__(self, merge_vertices=True, epsilon=dedup.DEFAULT_EPSILON, cache=None, jobs=1, max_influences=0):
+        # max_influences > 0 keeps that many of the largest weights per vertex,
+        # the others are described in sections.MeshWriter
+        super().__init__(merge_vertices, epsilon, cache, jobs)
+        self.max_influences = max_influences
+    
+    def state(self, mesh, skeleton, depsgraph):
+        # what the cached sections of mesh depend on besides its geometry
+        return (mesh.as_pointer(), mesh.data.name, tuple(g.name for g in mesh.vertex_groups),
+            tuple(skeleton.names), depsgraph.scene.name, depsgraph.view_layer.name,
+            self.merge_vertices, self.epsilon, self.max_influences)
+    
+    def extract(self, meshes, skeleton, depsgraph, reused):
+        # evaluates every mesh once through the depsgraph and frees the evaluated
+        # mesh as soon as its arrays are read. Posed meshes are unposed on the
+        # arrays, the scene is only read. Meshes with a reused cache entry are
+        # skipped (None arrays) unless their material entries moved
+        arrays = []
+        materials = MaterialTable()
+        face_materials = []
+        weights = []
+        slots = []
+        problems = []
+        for index, mesh in enumerate(meshes):
+            slots.append(materials.slots(mesh))
+            if reused[index] is not None:
+                if np.array_equal(reused[index].slots, slots[-1]):
+                    arrays.append(None)
+                    face_materials.append(None)
+                    weights.append(None)
+                    continue
+                reused[index] = None
+            m = posed_armature(mesh)
+            ob = mesh.evaluated_get(depsgraph)
+            me = ob.to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
+            try:
+                me.calc_loop_triangles()
+                groups = None
+                if m is not None or skeleton.armature is not None:
+                    groups = get_groups(me)
+                arrays.append(get_mesh_arrays(mesh, me, None if m is None else (m, groups)))
+                face_materials.append(materials.faces(mesh, me, slots[-1]))
+                if skeleton.armature is None:
+                    weights.append(origin_weights(len(me.vertices)))
+                    continue
+                vw, unweighted = get_vertex_weights(mesh, groups, skeleton.table, self.max_influences)
+                weights.append(vw)
+                if len(unweighted):
+                    problems.append("%s: %d (%s%s)" % (mesh.name, len(unweighted),
+                        ", ".join(str(i) for i in unweighted[:10].tolist()), ", ..." if len(unweighted) > 10 else ""))
+            finally:
+                ob.to_mesh_clear()
+        if problems:
+            raise Exception("Vertices without weights for any bone of %s: %s" % (skeleton.armature.name, "; ".join(problems)))
+        return arrays, materials, face_materials, weights, slots
+    
     def export_file(self, path):
         meshes = get_meshes()
-        
-        # limit all weights to max 4
-                
-        #for m in meshes:
-        #    m.select_set(True)
-        #    bpy.ops.object.mode_set(mode="WEIGHT_PAINT")
-        #    bpy.ops.object.vertex_group_limit_total(limit=4)
-        #    bpy.ops.object.mode_set(mode="OBJECT")
-        #    m.select_set(False)
+        # getting the depsgraph runs the pending updates, so the matrices read
+        # below are current and track_updates has seen every change before the
+        # clean meshes are looked up
+        depsgraph = bpy.context.evaluated_depsgraph_get()
         
         amt_ob = find_armature()
-
-        # deselect all
-        for obj in bpy.data.objects:
-            obj.select_set(False)
-
-        # add armature if there's none
         if amt_ob is None:
-            bpy.ops.object.armature_add()
-            amt_ob = bpy.context.scene.objects['Armature']
-            
-            for m in meshes:
-                m.select_set(True)
-                
-            amt_ob.select_set(True)
-            bpy.ops.object.parent_set(type='ARMATURE_AUTO')
-            #raise Exception("No armature found")
-        amt = amt_ob.data
+            skeleton = origin_skeleton()
+        else:
+            skeleton = armature_skeleton(amt_ob)
         
         with open(path, "w", encoding="utf-8") as f:
+            w = BlockWriter(f)
             
-            f.write("MODEL\n")
-            f.write("VERSION 6\n\n")
-            f.write("NUMBONES %d\n" % ( len(amt.bones) ))
-            
-            table = {}
-            
-            for index, b in enumerate(amt.bones):
-                parent_index = -1
-                if b.parent is not None:
-                    parent_index = table[b.parent.name]
-                f.write("BONE %d %d \"%s\"\n" % (index, parent_index, b.name))
-                table[b.name] = index
+            w.write(formatting.HEADER)
+            # the columns of a bone matrix are the axes of the bone
+            m = skeleton.matrices
+            formatting.write_bones(w, skeleton.names, skeleton.parents, m[:, :3, 3], m[:, :3, :3].transpose(0, 2, 1))
             
-            f.write("\n")
-            
-            for index, b in enumerate(amt.bones):
-                f.write("BONE %d\n" % (index))
-                m = b.matrix_local
-                f.write("OFFSET %f, %f, %f\n" % (m[0][3], m[1][3], m[2][3]))
-                f.write("SCALE 1.000000, 1.000000, 1.000000\n")
-                f.write("X %f, %f, %f\n" % (m[0][0], m[1][0], m[2][0]))
-                f.write("Y %f, %f, %f\n" % (m[0][1], m[1][1], m[2][1]))
-                f.write("Z %f, %f, %f\n" % (m[0][2], m[1][2], m[2][2]))
-                f.write("\n")
-            
-            numverts = 0
-            numfaces = 0
-            for mesh in meshes:
-                numverts += len(mesh.data.vertices)
-                numfaces += len(mesh.data.polygons)
-            f.write("NUMVERTS %d\n" % (numverts))
+            states = [None] * len(meshes)
+            reused = [None] * len(meshes)
+            if self.cache is not None:
+                self.cache.begin(path)
+                states = [self.state(mesh, skeleton, depsgraph) for mesh in meshes]
+                reused = [self.cache.clean(mesh, state) for mesh, state in zip(meshes, states)]
             
             # TODO FIXME: if the vertex group name doesn't match the bone name
-            total = 0
-            for mesh in meshes:
-                vgtable = {}
-                for gr in mesh.vertex_groups:
-                    vgtable[gr.index] = gr.name
-                for index, v in enumerate(mesh.data.vertices):
-                    f.write("VERT %d\n" % (index + total))
-                    f.write("OFFSET %f, %f, %f\n" % (v.co.x, v.co.y, v.co.z))
-                    
-                    vgroups = []
-                    for vg in v.groups:
-                        group_name = vgtable[vg.group]
-                        if not group_name in table:
-                            continue
-                        vgroups.append([group_name, vg.weight])
-                    if len(vgroups) == 0:
-                        raise Exception("Empty vgroups for %s" % (mesh))
-                        
-                    f.write("BONES %d\n" % (len(vgroups)))
-                    for group_name, weight in vgroups:
-                        f.write("BONE %d %f\n" % (table[group_name], weight))
-                    f.write("\n")
-                total += len(mesh.data.vertices)
-                
-            total = 0
-                    
-            f.write("NUMFACES %d\n" % (numfaces))
-            for mesh_index, mesh in enumerate(meshes):
-                for face in mesh.data.polygons:
-                    f.write("TRI %d %d 0 0\n" % (mesh_index, mesh_index))
-                    for v, l in zip(face.vertices, face.loop_indices):
-                        f.write("VERT %d\n" % (v + total))
-                        n = mesh.data.vertices[v].normal
-                        uv = mesh.data.uv_layers.active.data[l].uv
-                        f.write("NORMAL %f %f %f\n" % (n.x, n.y, n.z))
-                        f.write("COLOR 1.000000 1.000000 1.000000 1.000000\n")
-                        f.write("UV 1 %f %f\n" % (uv.x, 1.0 - uv.y))
-                total += len(mesh.data.vertices)
-            
-            f.write("\n")
-            f.write("NUMOBJECTS %d\n" % (len(meshes)))
-            for mesh_index, mesh in enumerate(meshes):
-                f.write("OBJECT %d \"%s\"\n" % (mesh_index, mesh.name))
-            f.write("\n")
-            
-            # https://blender.stackexchange.com/questions/80773/how-to-get-the-name-of-image-of-image-texture-with-python
-            def get_image_for_object(obj):
-                for s in obj.material_slots:
-                    if s.material and s.material.use_nodes:
-                        for n in s.material.node_tree.nodes:
-                            if n.type == 'TEX_IMAGE':
-                                return (s.material, n.image.name, n.image.filepath)
-                return None
-            
-            # TODO FIXME don't write them based off of objects/meshes and don't write duplicates
-            f.write("NUMMATERIALS %d\n" % (len(meshes)))
-            for mesh_index, mesh in enumerate(meshes):
-                img = get_image_for_object(mesh)
-                if img is None:
-                    f.write("MATERIAL %d \"material_%d\" \"Phong\" \"%s\"\n" % (mesh_index, mesh_index, ""))
-                else:
-                    f.write("MATERIAL %d \"%s\" \"Phong\" \"%s\"\n" % (mesh_index, img[0].name, img[1]))
-                f.write("COLOR 0.000000 0.000000 0.000000 1.000000\n")
-                f.write("TRANSPARENCY 0.000000 0.000000 0.000000 1.000000\n")
-                f.write("AMBIENTCOLOR 0.000000 0.000000 0.000000 1.000000\n")
-                f.write("INCANDESCENCE 0.000000 0.000000 0.000000 1.000000\n")
-                f.write("COEFFS 0.800000 0.000000\n")
-                f.write("GLOW 0.000000 0\n")
-                f.write("REFRACTIVE 6 1.000000\n")
-                f.write("SPECULARCOLOR -1.000000 -1.000000 -1.000000 1.000000\n")
-                f.write("REFLECTIVECOLOR -1.000000 -1.000000 -1.000000 1.000000\n")
-                f.write("REFLECTIVE -1 -1.000000\n")
-                f.write("BLINN -1.000000 -1.000000\n")
-                f.write("PHONG -1.000000\n")
-            f.write("\n")
+            with profiling.stage("extract", len(meshes)):
+                arrays, materials, face_materials, weights, slots = self.extract(meshes, skeleton, depsgraph, reused)
+            profiling.count("reused_objects", sum(e is not None for e in reused))
+            entries = self.write_meshes(w, [mesh.name for mesh in meshes], arrays, weights, face_materials, reused)
+            for e, state, s in zip(entries, states, slots):
+                e.state = state
+                e.slots = s
             
-            f.close()
\ No newline at end of file
+            w.write("\n")
+            formatting.write_objects(w, [(index, mesh.name) for index, mesh in enumerate(meshes)])
+            formatting.write_materials(w, [(index, name, image) for index, (name, image) in enumerate(materials.entries)])
+            with profiling.stage("flush"):
+                w.flush()
+            if self.cache is not None:
+                self.cache.replace({mesh.name: e for mesh, e in zip(meshes, entries)})
+            profiling.count("objects", len(meshes))
\ No newline at end of file
@@ -0,0 +1,220 @@
+# Text of the file's sections, kept free of bpy so the exporter can format
+# large meshes in worker processes and roundtrip.py can write parsed files.
+#
+# Sections are cut into chunks of whole vertices and whole faces. Each chunk
+# is formatted on its own with its global vertex numbers and the chunks are
+# written back in order, so the file does not depend on how many workers ran.
+
+import io
+
+import numpy as np
+
+from . import influences
+from . import workers
+
+HEADER = "MODEL\nVERSION 6\n\n"
+BONE_POSE = (
+    "BONE %d\n"
+    "OFFSET %f, %f, %f\n"
+    "SCALE 1.000000, 1.000000, 1.000000\n"
+    "X %f, %f, %f\n"
+    "Y %f, %f, %f\n"
+    "Z %f, %f, %f\n"
+    "\n"
+)
+VERT_HEAD = "VERT %d\nOFFSET %f, %f, %f\nBONES %d\n"
+VERT_BONE = "BONE %d %f\n"
+FACE_TRI = "TRI %d %d 0 0\n"
+FACE_CORNER = "VERT %d\nNORMAL %f %f %f\nCOLOR 1.000000 1.000000 1.000000 1.000000\nUV 1 %f %f\n"
+
+MATERIAL = "MATERIAL %d \"%s\" \"Phong\" \"%s\"\n"
+MATERIAL_PROPERTIES = (
+    "COLOR 0.000000 0.000000 0.000000 1.000000\n"
+    "TRANSPARENCY 0.000000 0.000000 0.000000 1.000000\n"
+    "AMBIENTCOLOR 0.000000 0.000000 0.000000 1.000000\n"
+    "INCANDESCENCE 0.000000 0.000000 0.000000 1.000000\n"
+    "COEFFS 0.800000 0.000000\n"
+    "GLOW 0.000000 0\n"
+    "REFRACTIVE 6 1.000000\n"
+    "SPECULARCOLOR -1.000000 -1.000000 -1.000000 1.000000\n"
+    "REFLECTIVECOLOR -1.000000 -1.000000 -1.000000 1.000000\n"
+    "REFLECTIVE -1 -1.000000\n"
+    "BLINN -1.000000 -1.000000\n"
+    "PHONG -1.000000\n"
+)
+
+CHUNK_ROWS = 1 << 15 # vertices or faces per chunk
+PARALLEL_MIN_ROWS = 1 << 17 # smaller exports are not worth starting workers for
+
+class BlockWriter():
+    # buffers formatted sections and writes them to the file in large chunks
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, s):
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def write_rows(self, fmt, values, per_row):
+        # formats len(values) / per_row rows of the same layout with a single % operation
+        rows = len(values) // per_row
+        step = max(1, self.chunk_size // max(1, len(fmt) * 2))
+        for s in range(0, rows, step):
+            n = min(step, rows - s)
+            self.write((fmt * n) % tuple(values[s * per_row:(s + n) * per_row]))
+
+    def flush(self):
+        if self.parts:
+            self.f.write("".join(self.parts))
+            self.parts = []
+            self.size = 0
+
+def write_bones(w, names, parents, offsets, axes):
+    # the NUMBONES section, axes holds the X, Y and Z vectors of every bone as rows
+    w.write("NUMBONES %d\n" % (len(names)))
+    for index, (name, parent) in enumerate(zip(names, parents)):
+        w.write("BONE %d %d \"%s\"\n" % (index, parent, name))
+    w.write("\n")
+    rows = np.empty((len(names), 13), dtype=np.float64)
+    rows[:, 0] = np.arange(len(names))
+    rows[:, 1:4] = np.asarray(offsets).reshape(-1, 3)
+    rows[:, 4:] = np.asarray(axes).reshape(-1, 9)
+    w.write_rows(BONE_POSE, rows.ravel().tolist(), 13)
+
+def write_objects(w, objects):
+    # objects is a list of (index, name)
+    w.write("NUMOBJECTS %d\n" % (len(objects)))
+    for index, name in objects:
+        w.write("OBJECT %d \"%s\"\n" % (index, name))
+    w.write("\n")
+
+def write_materials(w, materials):
+    # materials is a list of (index, name, image path)
+    w.write("NUMMATERIALS %d\n" % (len(materials)))
+    for index, name, image in materials:
+        w.write(MATERIAL % (index, name, image))
+        w.write(MATERIAL_PROPERTIES)
+    w.write("\n")
+
+def write_vertices(w, co, weights, keep, total):
+    # writes the vertices in keep, numbered from total
+    offsets, bones, weight_values = weights
+    offsets = offsets.tolist()
+    bones = bones.tolist()
+    weight_values = weight_values.tolist()
+    co = co.tolist()
+    templates = {}
+    fmt = []
+    values = []
+    for n, index in enumerate(keep.tolist()):
+        s = offsets[index]
+        e = offsets[index + 1]
+        k = e - s
+        if not k in templates:
+            templates[k] = VERT_HEAD + VERT_BONE * k + "\n"
+        fmt.append(templates[k])
+        x, y, z = co[index]
+        values += (n + total, x, y, z, k)
+        for i in range(s, e):
+            values += (bones[i], weight_values[i])
+
+        if len(fmt) == 4096:
+            w.write("".join(fmt) % tuple(values))
+            fmt = []
+            values = []
+    if fmt:
+        w.write("".join(fmt) % tuple(values))
+
+def face_corners(remap, normals, loop_vertices, loop_starts, loop_totals, uvs, total):
+    # face corners in polygon order, one row of 6 values each: written vertex, normal and flipped uv
+    loops = influences.ranges(loop_starts, loop_totals)
+    corners = np.empty((len(loops), 6), dtype=np.float64)
+    corners[:, 0] = remap[loop_vertices[loops]] + total
+    corners[:, 1:4] = normals[loops]
+    corners[:, 4] = uvs[loops, 0]
+    corners[:, 5] = 1.0 - uvs[loops, 1].astype(np.float64)
+    return corners
+
+def write_corners(w, mesh_index, materials, loop_totals, corners):
+    # materials is the MATERIAL index of every face
+    if len(loop_totals) == 0:
+        return
+    first = np.cumsum(loop_totals) - loop_totals
+    # faces are written in runs of the same corner count, usually a single run
+    # of triangles, one row per face of its TRI values and its corners
+    breaks = np.flatnonzero(loop_totals[1:] != loop_totals[:-1]) + 1
+    for s, e in zip(np.append(0, breaks).tolist(), np.append(breaks, len(loop_totals)).tolist()):
+        n = int(loop_totals[s])
+        rows = np.empty((e - s, 2 + 6 * n), dtype=np.float64)
+        rows[:, 0] = mesh_index
+        rows[:, 1] = materials[s:e]
+        rows[:, 2:] = corners[first[s]:first[e - 1] + n].reshape(e - s, 6 * n)
+        w.write_rows(FACE_TRI + FACE_CORNER * n, rows.ravel().tolist(), 2 + 6 * n)
+
+def write_faces(w, mesh_index, materials, remap, normals, loop_vertices, loop_starts, loop_totals, uvs, total):
+    if len(loop_totals) == 0:
+        return
+    write_corners(w, mesh_index, materials, loop_totals, face_corners(remap, normals, loop_vertices, loop_starts, loop_totals, uvs, total))
+
+def format_section(fn, *args):
+    # runs a write_* function into a string instead of the file
+    s = io.StringIO()
+    w = BlockWriter(s)
+    fn(w, *args)
+    w.flush()
+    return s.getvalue()
+
+def format_vertices(co, weights, total):
+    return format_section(write_vertices, co, weights, np.arange(len(co)), total)
+
+def format_corners(mesh_index, materials, loop_totals, corners):
+    return format_section(write_corners, mesh_index, materials, loop_totals, corners)
+
+def vertex_chunks(co, weights, keep, total, rows=CHUNK_ROWS):
+    # (function, args) per chunk, each carrying only its own vertices
+    for s in range(0, len(keep), rows):
+        sub = keep[s:s + rows]
+        yield format_vertices, (co[sub], influences.take(weights, sub), total + s)
+
+def face_chunks(mesh_index, materials, remap, normals, loop_vertices, loop_starts, loop_totals, uvs, total, rows=CHUNK_ROWS):
+    if len(loop_totals) == 0:
+        return
+    corners = face_corners(remap, normals, loop_vertices, loop_starts, loop_totals, uvs, total)
+    first = np.append(np.cumsum(loop_totals) - loop_totals, len(corners))
+    for s in range(0, len(loop_totals), rows):
+        e = min(s + rows, len(loop_totals))
+        yield format_corners, (mesh_index, materials[s:e], loop_totals[s:e], corners[first[s]:first[e]])
+
+class Formatter():
+    # runs chunks in a workers.Pool, or lazily in this process for jobs == 1.
+    # submit() returns an iterator over the chunk texts in order
+    def __init__(self, jobs=1, rows=0):
+        # jobs 0 or None means one worker per cpu, rows is the amount of work
+        # ahead and decides whether workers are worth it
+        jobs = workers.count(jobs)
+        self.pool = None
+        if jobs > 1 and rows >= PARALLEL_MIN_ROWS:
+            self.pool = workers.Pool(jobs)
+
+    def submit(self, chunks):
+        if self.pool is None:
+            return (fn(*args) for fn, args in chunks)
+        pending = [self.pool.submit(fn, *args) for fn, args in chunks]
+        return (p() for p in pending)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
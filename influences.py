@@ -0,0 +1,63 @@
+# Bone influences as flat arrays: offsets (one more than there are vertices),
+# bones and weights, the same layout as Parser.weight_offsets/weight_bones/
+# weight_values.
+
+import numpy as np
+
+def ranges(starts, counts):
+    # start, start + 1, ... for every (start, count) pair, one run after the
+    # other. Gathers the influences of some vertices or the corners of some faces
+    counts = np.asarray(counts)
+    first = np.cumsum(counts) - counts
+    return np.repeat(np.asarray(starts) - first, counts) + np.arange(counts.sum())
+
+def take(weights, vertex_indices):
+    # (offsets, bones, weights) of the given vertices only
+    offsets, bones, values = weights
+    starts = offsets[vertex_indices]
+    counts = offsets[vertex_indices + 1] - starts
+    sub = np.zeros(len(vertex_indices) + 1, dtype=np.int64)
+    np.cumsum(counts, out=sub[1:])
+    w = ranges(starts, counts)
+    return sub, bones[w], values[w]
+
+def from_groups(counts, groups, weights, group_bones):
+    # per vertex vertex group memberships -> influences on bones. group_bones
+    # maps a vertex group index to its bone, -1 for groups that are no bone;
+    # those memberships are dropped. Also returns the vertices left without any
+    counts = np.asarray(counts, dtype=np.int64)
+    groups = np.asarray(groups, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    group_bones = np.append(np.asarray(group_bones, dtype=np.int64), -1)
+    # unknown group indices map onto the trailing -1
+    groups = np.where((groups >= 0) & (groups < len(group_bones) - 1), groups, len(group_bones) - 1)
+    bones = group_bones[groups]
+    used = bones >= 0
+    rows = np.repeat(np.arange(len(counts)), counts)[used]
+    counts = np.bincount(rows, minlength=len(counts))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return (offsets, bones[used], weights[used]), np.flatnonzero(counts == 0)
+
+def limit(offsets, bones, weights, max_influences):
+    # keeps the max_influences largest weights of every vertex, in their original
+    # order, and renormalizes the vertices that lost some so they sum to 1 again
+    counts = np.diff(offsets)
+    if max_influences <= 0 or len(counts) == 0 or counts.max() <= max_influences:
+        return offsets, bones, weights
+    rows = np.repeat(np.arange(len(counts)), counts)
+    order = np.lexsort((-weights, rows))
+    rank = np.arange(len(rows)) - np.repeat(offsets[:-1], counts)
+    keep = np.zeros(len(rows), dtype=bool)
+    keep[order[rank < max_influences]] = True
+
+    bones = bones[keep]
+    weights = weights[keep]
+    rows = rows[keep]
+    capped = counts > max_influences
+    counts = np.minimum(counts, max_influences)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    totals = np.bincount(rows, weights, minlength=len(counts))
+    scale = np.where(capped & (totals > 0), 1.0 / np.where(totals > 0, totals, 1.0), 1.0)
+    return offsets, bones, weights * scale[rows]
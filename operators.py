@@ -0,0 +1,707 @@
+from . import parser
+from . import cache
+from . import profiling
+from . import export
+from . import dedup
+from . import validate
+from . import workers
+
+import bpy
+import concurrent.futures
+import contextlib
+import os
+import threading
+import time
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty, IntProperty, CollectionProperty
+from bpy.types import Operator, OperatorFileListElement
+import numpy as np
+
+def build_mesh(mesh, positions, loop_vertices, loop_totals):
+    # fills an empty mesh straight from flat arrays, without from_pydata or bmesh
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", positions.ravel())
+    
+    mesh.loops.add(len(loop_vertices))
+    mesh.loops.foreach_set("vertex_index", loop_vertices.astype(np.int32))
+    
+    loop_starts = np.cumsum(loop_totals) - loop_totals
+    mesh.polygons.add(len(loop_totals))
+    mesh.polygons.foreach_set("loop_start", loop_starts.astype(np.int32))
+    if not bpy.types.MeshPolygon.bl_rna.properties["loop_total"].is_readonly: # read-only since Blender 4.0
+        mesh.polygons.foreach_set("loop_total", loop_totals.astype(np.int32))
+    
+    mesh.update(calc_edges=True)
+
+def sharp_edges(mesh, loop_normals, epsilon=dedup.DEFAULT_EPSILON):
+    # edges where the faces on either side disagree on a corner normal, these
+    # have to be sharp or normals_split_custom_set averages the two normals
+    nl = len(mesh.loops)
+    loop_edges = np.empty(nl, dtype=np.int32)
+    mesh.loops.foreach_get("edge_index", loop_edges)
+    loop_verts = np.empty(nl, dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    starts = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", starts)
+    totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", totals)
+    
+    # a loop's edge runs from its vertex to the next loop's vertex
+    nxt = np.arange(1, nl + 1)
+    nxt[starts + totals - 1] = starts
+    edges = np.concatenate((loop_edges, loop_edges))
+    verts = np.concatenate((loop_verts, loop_verts[nxt]))
+    normals = np.concatenate((loop_normals, loop_normals[nxt]))
+    order = np.lexsort((verts, edges))
+    edges = edges[order]
+    verts = verts[order]
+    normals = normals[order]
+    same = (edges[1:] == edges[:-1]) & (verts[1:] == verts[:-1])
+    differ = np.abs(normals[1:] - normals[:-1]).max(axis=1) > epsilon
+    sharp = np.zeros(len(mesh.edges), dtype=bool)
+    sharp[edges[1:][same & differ]] = True
+    return sharp
+
+def set_loop_data(mesh, loop_uvs, loop_normals):
+    uv_layer = mesh.uv_layers.new()
+    uv_layer.data.foreach_set("uv", loop_uvs.astype(np.float32).ravel())
+    
+    lengths = np.linalg.norm(loop_normals, axis=1)
+    loop_normals = loop_normals / np.where(lengths > 0, lengths, 1)[:, None]
+    mesh.edges.foreach_set("use_edge_sharp", sharp_edges(mesh, loop_normals))
+    mesh.normals_split_custom_set(loop_normals)
+    if hasattr(mesh, "use_auto_smooth"): # removed in Blender 4.1
+        mesh.use_auto_smooth = True
+    
+    mesh.update()
+
+def assign_weights(obj, imp, vertex_indices, bone_names=None):
+    # bone_names are the names the bones got in the armature, the file's tags
+    # can repeat and Blender renames the duplicates
+    if bone_names is None:
+        bone_names = imp.bone_names
+    groups = [obj.vertex_groups.new(name=name) for name in bone_names]
+    for bone_index, weight, v_idx in imp.weight_groups(vertex_indices):
+        groups[bone_index].add(v_idx.tolist(), weight, 'ADD')
+
+def object_arrays(imp, o, epsilon=None):
+    # vertices used by the object, its loops remapped onto them, the corner
+    # count per face and the file loops in mesh loop order. With an epsilon,
+    # vertices with the same position and weights are merged, the loops keep
+    # their own uv and normal so seams and hard edges survive
+    loops = imp.face_loops(o.face_indices)
+    loop_totals = imp.face_loop_total[o.face_indices]
+    used, loop_verts = np.unique(imp.loop_vertices[loops], return_inverse=True)
+    loop_verts = loop_verts.ravel()
+    if epsilon is not None and len(used):
+        keep, remap = dedup.dedup(imp.positions[used], weights=imp.vertex_weights(used), epsilon=epsilon)
+        merged = remap[loop_verts]
+        # objects with a face that would collapse keep the file's vertices
+        if dedup.distinct_corners(merged, loop_totals) == dedup.distinct_corners(loop_verts, loop_totals):
+            used = used[keep]
+            loop_verts = merged
+    return used, loop_verts, loop_totals, loops
+
+def bone_matrices(imp):
+    # (B, 4, 4) rows x, y, z and offset, the layout bone.matrix is set from
+    mats = np.zeros((len(imp.bone_names), 4, 4), dtype=np.float64)
+    mats[:, :3, :3] = imp.bone_axes
+    mats[:, 3, :3] = imp.bone_offsets
+    mats[:, 3, 3] = 1.0
+    return mats
+
+def build_armatures(imps):
+    # one armature per parser, all of them built in a single edit mode session.
+    # Returns (armature object, bone names) per parser
+    objs = []
+    for imp in imps:
+        amt = bpy.data.armatures.new("Rig")
+        amt_ob = bpy.data.objects.new("Rig", amt)
+        bpy.context.collection.objects.link(amt_ob)
+        objs.append(amt_ob)
+    if len(objs) == 0:
+        return []
+
+    for ob in bpy.context.view_layer.objects:
+        ob.select_set(False)
+    for amt_ob in objs:
+        amt_ob.select_set(True)
+    bpy.context.view_layer.objects.active = objs[0]
+
+    with profiling.stage("armature", sum(len(imp.bone_names) for imp in imps)):
+        bpy.ops.object.mode_set(mode='EDIT')
+        names = [armature_edit_bones(amt_ob.data, imp) for amt_ob, imp in zip(objs, imps)]
+        bpy.ops.object.mode_set(mode='OBJECT')
+    return list(zip(objs, names))
+
+def build_armature(imp):
+    return build_armatures([imp])[0]
+
+def armature_edit_bones(amt, imp):
+    # expects a new, empty amt in edit mode, returns the names Blender gave the bones
+    edit_bones = amt.edit_bones
+    bones = [edit_bones.new(tag) for tag in imp.bone_names]
+    # foreach_set skips the per bone update that setting tail one by one runs
+    edit_bones.foreach_set("tail", np.tile(np.array((0.0, 0.0, 1.0), dtype=np.float32), len(bones)))
+    edit_bones.foreach_set("use_deform", np.ones(len(bones), dtype=bool))
+    edit_bones.foreach_set("matrix", bone_matrices(imp).astype(np.float32).ravel())
+    # parents are set once every bone exists, by index, so duplicate tags and
+    # parents listed after their children resolve to the right bone. Bones stay
+    # unconnected, connecting would move their heads onto the parent's tail
+    for bone, parent in zip(bones, imp.bone_parents.tolist()):
+        if parent != -1:
+            bone.parent = bones[parent]
+    return [bone.name for bone in bones]
+
+def build_object(imp, o, amt_ob, bone_names=None, epsilon=None, uv_policy='WRAP', materials=None):
+    for obj in object_steps(imp, o, amt_ob, bone_names, epsilon, uv_policy, materials):
+        pass
+    return obj
+
+def object_steps(imp, o, amt_ob, bone_names=None, epsilon=None, uv_policy='WRAP', materials=None):
+    # build_object in steps for the background import, yields None after the
+    # mesh and the weights and the object at the end. materials is a
+    # MaterialCache, None imports no materials. Closed or failing before the
+    # end, the half built mesh and object are removed again
+    mesh = bpy.data.meshes.new(o.name)
+    obj = None
+    try:
+        with profiling.stage("mesh_build", len(o.face_indices)):
+            used, loop_verts, loop_totals, loops = object_arrays(imp, o, epsilon)
+            build_mesh(mesh, imp.positions[used], loop_verts, loop_totals)
+        if materials is not None:
+            with profiling.stage("materials", len(o.face_indices)):
+                assign_materials(mesh, imp, o.face_indices, materials)
+        yield None
+        
+        obj = bpy.data.objects.new(o.name, mesh)
+        obj.parent = amt_ob
+        
+        with profiling.stage("weights", len(used)):
+            assign_weights(obj, imp, used, bone_names)
+        yield None
+        
+        mod = obj.modifiers.new("Rig", "ARMATURE")
+        mod.object = amt_ob
+        
+        with profiling.stage("uv_normals", len(loop_verts)):
+            set_loop_data(mesh, parser.convert_uvs(imp.loop_uvs[loops], uv_policy), imp.loop_normals[loops])
+        bpy.context.collection.objects.link(obj)
+    except BaseException:
+        if obj is not None:
+            bpy.data.objects.remove(obj)
+        bpy.data.meshes.remove(mesh)
+        raise
+    profiling.count("objects", 1)
+    yield obj
+
+def report_profile(op, prof, what):
+    if not prof.enabled:
+        return
+    op.report({'INFO'}, "XModel %s %s" % (what, prof.summary()))
+    try:
+        prof.write(op.filepath, operator=what, file=op.filepath)
+    except OSError as e:
+        print("Could not write profile for %s: %s" % (op.filepath, str(e)))
+
+def find_object_indices(path, spec):
+    # "head, 2" -> indices of the OBJECT named head and of object 2
+    indices = set()
+    names = None
+    for s in spec.split(","):
+        s = s.strip()
+        if len(s) == 0:
+            continue
+        if s.isdigit():
+            indices.add(int(s))
+            continue
+        if names is None:
+            names = {name: i for i, name in parser.peek(path)["objects"]}
+        if not s in names:
+            raise Exception("No object named %s" % (s))
+        indices.add(names[s])
+    return indices
+
+def model_sections(path, import_mode='ALL', object_filter=""):
+    # (sections, object indices) of path to parse for the import options,
+    # None for all of them
+    if import_mode == 'SKELETON':
+        return ("bones",), None
+    if object_filter.strip():
+        return None, find_object_indices(path, object_filter)
+    return None, None
+
+def model_objects(imp, import_mode='ALL', wanted=None):
+    if import_mode == 'SKELETON':
+        return []
+    if wanted is not None:
+        return [o for o in imp.objects if o.index in wanted]
+    return imp.objects
+
+def check_model(path, imp, validation='REPORT'):
+    # problems of a parsed file for the Validation option, raises a
+    # ValidationError with the lines of those the file is refused for
+    if validation == 'NONE':
+        return []
+    with profiling.stage("validate"):
+        problems = validate.validate(imp, fail_fast=validation == 'STRICT')
+    refused = problems
+    if validation != 'STRICT':
+        refused = [p for p in problems if p.severity == validate.ERROR]
+    if refused:
+        validate.locate(path, refused, imp.sections, imp.object_filter)
+        raise validate.ValidationError(refused)
+    return problems
+
+def read_model(path, import_mode='ALL', object_filter="", use_cache=False, validation='REPORT', cancel=None):
+    # parser, the objects to build and the problems found for one file,
+    # touches no bpy data so it can run on a worker thread
+    sections, wanted = model_sections(path, import_mode, object_filter)
+    if use_cache:
+        imp = cache.read_file(path)
+    else:
+        imp = parser.Parser()
+        imp.read_file(path, sections, wanted, cancel)
+    problems = check_model(path, imp, validation)
+    return imp, model_objects(imp, import_mode, wanted), problems
+
+def read_models(paths, jobs=0, import_mode='ALL', object_filter="", use_cache=False, validation='REPORT'):
+    # read_model for every file, files of parser.PARALLEL_MIN_BYTES and up are parsed in worker processes
+    if use_cache or len(paths) < 2:
+        return [read_model(path, import_mode, object_filter, use_cache, validation) for path in paths]
+    plans = [model_sections(path, import_mode, object_filter) for path in paths]
+    with profiling.stage("read", len(paths)):
+        imps = parser.read_files([(path, sections, wanted) for path, (sections, wanted) in zip(paths, plans)], jobs)
+    return [(imp, model_objects(imp, import_mode, wanted), check_model(path, imp, validation))
+        for path, imp, (sections, wanted) in zip(paths, imps, plans)]
+
+def report_problems(op, paths, problems, limit=5):
+    # warnings for the problems files were imported with
+    found = [(path, p) for path, ps in zip(paths, problems) for p in ps]
+    for path, p in found[:limit]:
+        op.report({'WARNING'}, "%s: %s" % (os.path.basename(path), str(p)))
+    if len(found) > limit:
+        op.report({'WARNING'}, "%d more problems, see the console" % (len(found) - limit))
+    for path, p in found:
+        print("%s: %s" % (path, str(p)))
+
+def share_armatures(imps, share=True):
+    # (armature object, bone names) per parser. With share, parsers with the
+    # same skeleton_key() get the same armature, built once
+    first = {}
+    keys = []
+    for i, imp in enumerate(imps):
+        keys.append(imp.skeleton_key() if share else i)
+        first.setdefault(keys[-1], i)
+    built = sorted(set(first.values()))
+    armatures = dict(zip(built, build_armatures([imps[i] for i in built])))
+    return [armatures[first[k]] for k in keys]
+
+# seconds of building per timer tick of a background import
+IMPORT_SLICE = 0.05
+
+class ImportJob():
+    # files parsed on worker threads, built on the main thread in file order a
+    # step (an armature or an object) at a time
+    def __init__(self, paths, jobs, epsilon, uv_policy='WRAP', share_skeletons=True, materials=None, **options):
+        jobs = workers.count(jobs)
+        self.epsilon = epsilon
+        self.uv_policy = uv_policy
+        self.materials = materials
+        self.paths = paths
+        self.problems = []
+        self.share_skeletons = share_skeletons
+        self.cancel = threading.Event()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(jobs, len(paths))))
+        self.futures = [self.pool.submit(read_model, path, cancel=self.cancel, **options) for path in paths]
+        self.progress = 0.0
+        self.steps = self.build()
+    
+    def build(self):
+        # yields True while waiting on a parse, False after each step
+        armatures = {}
+        for i, future in enumerate(self.futures):
+            while not future.done():
+                yield True
+            imp, objects, problems = future.result()
+            self.problems.append(problems)
+            key = imp.skeleton_key() if self.share_skeletons else i
+            if not key in armatures:
+                armatures[key] = build_armature(imp)
+                yield False
+            amt_ob, bone_names = armatures[key]
+            self.progress = i + 1.0 / (len(objects) + 1)
+            for n, o in enumerate(objects):
+                with contextlib.closing(object_steps(imp, o, amt_ob, bone_names, self.epsilon, self.uv_policy, self.materials)) as steps:
+                    for step in steps:
+                        yield False
+                self.progress = i + (n + 2.0) / (len(objects) + 1)
+    
+    def run(self, seconds):
+        # builds until seconds ran out or the next file is still parsing,
+        # returns False once everything is built
+        end = time.perf_counter() + seconds
+        for waiting in self.steps:
+            if waiting or time.perf_counter() >= end:
+                return True
+        return False
+    
+    def close(self):
+        # the object being built when cancelled is removed, finished ones stay
+        self.steps.close()
+        self.cancel.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+# https://blender.stackexchange.com/questions/153746/apply-image-on-mesh-surface
+def new_material(name, texture_path):
+    mat = bpy.data.materials.new(name=name)
+    mat.use_nodes = True
+    if texture_path:
+        nodes = mat.node_tree.nodes
+        texImage = nodes.new('ShaderNodeTexImage')
+        texImage.image = bpy.data.images.load(texture_path, check_existing=True)
+        principled = nodes.get('Principled BSDF')
+        if principled is not None:
+            mat.node_tree.links.new(texImage.outputs[0], principled.inputs[0])
+    return mat
+
+class MaterialCache():
+    # Blender materials created by earlier imports, keyed by MATERIAL name and
+    # texture. Only names are kept, a material deleted since is created again
+    def __init__(self):
+        self.materials = {}
+        self.textures = {}
+    
+    def texture(self, imp, path):
+        # the image file of a MATERIAL, looked up next to the model when relative
+        if not path:
+            return ""
+        key = (os.path.dirname(os.path.abspath(imp.filepath or "")), path)
+        if not key in self.textures:
+            found = ""
+            for p in (path, os.path.join(key[0], path)):
+                if os.path.isfile(p):
+                    found = p
+                    break
+            self.textures[key] = found
+        return self.textures[key]
+    
+    def get(self, imp, index):
+        m = imp.material_table().get(index)
+        name = "material_%d" % (index) if m is None else m.name
+        texture = "" if m is None else self.texture(imp, m.texture_path)
+        mat = bpy.data.materials.get(self.materials.get((name, texture), ""))
+        if mat is None:
+            mat = new_material(name, texture)
+            self.materials[(name, texture)] = mat.name
+        return mat
+
+material_cache = MaterialCache()
+
+def assign_materials(mesh, imp, face_indices, materials):
+    # one slot per MATERIAL used by the faces, set on all polygons at once
+    used, slots = np.unique(imp.face_materials[face_indices], return_inverse=True)
+    for index in used.tolist():
+        mesh.materials.append(materials.get(imp, index))
+    mesh.polygons.foreach_set("material_index", slots.ravel().astype(np.int32))
+        
+class XModelExporter(Operator, ExportHelper):
+    """XModelExporter""" # Use this as a tooltip for menu items and buttons.
+    bl_idname = "export_scene.xmodel_export" # Unique identifier for buttons and menu items to reference.
+    bl_label = "Export XModel" # Display name in the interface.
+    
+    filename_ext = ".xmodel_export"
+    filter_glob: StringProperty(
+        default="*.xmodel_export",
+        options={'HIDDEN'},
+        maxlen=255,
+    )
+    profile: BoolProperty(
+        name="Profile",
+        description=(
+            "Record the time spent in each stage, report a summary and "
+            "write it next to the file as .profile.json"
+        ),
+        default=False,
+    )
+    profile_cprofile: BoolProperty(
+        name="cProfile",
+        description="Also capture a cProfile of the whole run into a .prof file next to the file",
+        default=False,
+    )
+    merge_vertices: BoolProperty(
+        name="Merge vertices",
+        description=(
+            "Write vertices with the same position and weights once, "
+            "face corners keep their own normal and uv"
+        ),
+        default=True,
+    )
+    merge_epsilon: FloatProperty(
+        name="Merge distance",
+        description="Positions and weights closer than this count as equal when merging vertices",
+        default=dedup.DEFAULT_EPSILON,
+        min=0.0,
+        precision=6,
+    )
+    incremental: BoolProperty(
+        name="Incremental",
+        description=(
+            "Keep the written vertex and face sections in memory (up to 256 MB) "
+            "and reuse them for unchanged meshes when exporting to the same file again. "
+            "Meshes without geometry or transform updates since the last export are not "
+            "evaluated at all, changed ones are read again in full"
+        ),
+        default=False,
+    )
+    max_influences: IntProperty(
+        name="Max influences",
+        description=(
+            "Keep only this many of the largest bone weights per vertex and "
+            "renormalize the rest, 0 keeps them all"
+        ),
+        default=0,
+        min=0,
+    )
+    jobs: IntProperty(
+        name="Jobs",
+        description=(
+            "Worker processes formatting the vertex and face text of large exports, "
+            "0 uses one per cpu and 1 formats everything in Blender itself"
+        ),
+        default=0,
+        min=0,
+    )
+    
+    def execute(self, context): # execute() is called when running the operator.
+        cache = export.section_cache if self.incremental else None
+        exp = export.Exporter(self.merge_vertices, self.merge_epsilon, cache, self.jobs, self.max_influences)
+        prof = profiling.create(self.profile, self.profile_cprofile)
+        with profiling.enabled(prof):
+            try:
+                exp.export_file(self.filepath)
+            except Exception as e:
+                print("Error exporting file. Error: %s" % (str(e)))
+                self.report({'ERROR'}, "Error exporting file: %s" % (str(e)))
+                return {'CANCELLED'}
+        report_profile(self, prof, "export")
+        return {'FINISHED'} # Lets Blender know the operator finished successfully.
+        
+class XModelImporter(Operator, ImportHelper):
+    """XModelImporter""" # Use this as a tooltip for menu items and buttons.
+    bl_idname = "import_scene.xmodel_export" # Unique identifier for buttons and menu items to reference.
+    bl_label = "Import XModel" # Display name in the interface.
+    
+    filename_ext = ".xmodel_export"
+    filter_glob: StringProperty(
+        default="*.xmodel_export",
+        options={'HIDDEN'},
+        maxlen=255,
+    )
+    files: CollectionProperty(
+        type=OperatorFileListElement,
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+    directory: StringProperty(
+        subtype='DIR_PATH',
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+    use_cache: BoolProperty(
+        name="Use cache",
+        description=(
+            "Keep a binary copy of the parsed file and memory map it "
+            "on the next import of the unchanged file"
+        ),
+        default=False,
+    )
+    import_mode: EnumProperty(
+        name="Import",
+        items=(
+            ('ALL', "Everything", "Skeleton and objects"),
+            ('SKELETON', "Skeleton only", "Only build the rig, vertex and face blocks are skipped"),
+        ),
+        default='ALL',
+    )
+    object_filter: StringProperty(
+        name="Objects",
+        description="Comma separated OBJECT names or indices to import, all objects when empty",
+        default="",
+    )
+    profile: BoolProperty(
+        name="Profile",
+        description=(
+            "Record the time spent in each stage, report a summary and "
+            "write it next to the file as .profile.json"
+        ),
+        default=False,
+    )
+    profile_cprofile: BoolProperty(
+        name="cProfile",
+        description="Also capture a cProfile of the whole run into a .prof file next to the file",
+        default=False,
+    )
+    merge_vertices: BoolProperty(
+        name="Merge vertices",
+        description=(
+            "Merge vertices with the same position and weights, "
+            "face corners keep their own normal and uv"
+        ),
+        default=True,
+    )
+    merge_epsilon: FloatProperty(
+        name="Merge distance",
+        description="Positions and weights closer than this count as equal when merging vertices",
+        default=dedup.DEFAULT_EPSILON,
+        min=0.0,
+        precision=6,
+    )
+    uv_policy: EnumProperty(
+        name="UVs",
+        description="What happens to uvs outside of the 0-1 range",
+        items=(
+            ('WRAP', "Wrap", "Fold them back into 0-1"),
+            ('CLAMP', "Clamp", "Clip them to 0-1"),
+            ('PRESERVE', "Preserve", "Keep them as they are, for tiled textures"),
+        ),
+        default='WRAP',
+    )
+    validation: EnumProperty(
+        name="Validation",
+        description="Checks on the parsed file before anything is built",
+        items=(
+            ('NONE', "Off", "Build without checking"),
+            ('REPORT', "Report", "Refuse files that would break the import, import the rest and report their problems"),
+            ('STRICT', "Strict", "Refuse files with any problem, stopping at the first one"),
+        ),
+        default='REPORT',
+    )
+    use_background: BoolProperty(
+        name="Background",
+        description=(
+            "Parse on worker threads and build the objects a few at a time "
+            "so Blender stays responsive, Esc cancels. Not used when profiling"
+        ),
+        default=False,
+    )
+    share_skeletons: BoolProperty(
+        name="Share skeletons",
+        description=(
+            "Files with the same bones (names, parents and matrices) "
+            "get one armature with all their meshes attached"
+        ),
+        default=True,
+    )
+    jobs: IntProperty(
+        name="Parse jobs",
+        description="Files parsed at the same time, 0 uses one per cpu",
+        default=0,
+        min=0,
+    )
+    import_materials: BoolProperty(
+        name="Import materials",
+        description=(
+            "Give every face its MATERIAL, reusing the materials of earlier "
+            "imports with the same name and texture"
+        ),
+        default=True,
+    )
+    
+    def paths(self):
+        paths = [os.path.join(self.directory, f.name) for f in self.files if f.name]
+        return paths or [self.filepath]
+    
+    def execute(self, context): # execute() is called when running the operator.
+        prof = profiling.create(self.profile, self.profile_cprofile)
+        if self.use_background and not prof.enabled and context.window is not None:
+            return self.start(context)
+        with profiling.enabled(prof):
+            try:
+                paths = self.paths()
+                files = read_models(paths, self.jobs, self.import_mode, self.object_filter, self.use_cache, self.validation)
+                report_problems(self, paths, [problems for imp, objects, problems in files])
+                
+                # every skeleton is built in one edit mode session
+                epsilon = self.merge_epsilon if self.merge_vertices else None
+                materials = material_cache if self.import_materials else None
+                armatures = share_armatures([imp for imp, objects, problems in files], self.share_skeletons)
+                for (imp, objects, problems), (amt_ob, bone_names) in zip(files, armatures):
+                    for o in objects:
+                        build_object(imp, o, amt_ob, bone_names, epsilon, self.uv_policy, materials)
+            
+            except Exception as e:
+                print("Error importing file. Error: %s" % (str(e)))
+                self.report({'ERROR'}, "Error importing file: %s" % (str(e)))
+                return {'CANCELLED'}
+        report_profile(self, prof, "import")
+        return {'FINISHED'} # Lets Blender know the operator finished successfully.
+    
+    def start(self, context):
+        paths = self.paths()
+        self.job = ImportJob(
+            paths,
+            self.jobs,
+            self.merge_epsilon if self.merge_vertices else None,
+            self.uv_policy,
+            self.share_skeletons,
+            material_cache if self.import_materials else None,
+            import_mode=self.import_mode,
+            object_filter=self.object_filter,
+            use_cache=self.use_cache,
+            validation=self.validation,
+        )
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.02, window=context.window)
+        wm.progress_begin(0, len(paths))
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def stop(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        self.job.close()
+    
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.stop(context)
+            self.report({'WARNING'}, "XModel import cancelled, objects built so far are kept")
+            return {'CANCELLED'}
+        if event.type != 'TIMER' or event.timer != self.timer:
+            return {'PASS_THROUGH'}
+        try:
+            running = self.job.run(IMPORT_SLICE)
+        except Exception as e:
+            print("Error importing file. Error: %s" % (str(e)))
+            self.report({'ERROR'}, "Error importing file: %s" % (str(e)))
+            self.stop(context)
+            return {'CANCELLED'}
+        context.window_manager.progress_update(self.job.progress)
+        if running:
+            return {'RUNNING_MODAL'}
+        report_problems(self, self.job.paths, self.job.problems)
+        self.stop(context)
+        return {'FINISHED'}
+    
+
+__classes__ = (
+    XModelImporter,
+    XModelExporter,
+)
+
+def menu_func_import(self, context):
+    self.layout.operator(XModelImporter.bl_idname, text="Import XModel (.xmodel_export)")
+def menu_func_export(self, context):
+    self.layout.operator(XModelExporter.bl_idname, text="Export XModel (.xmodel_export)")
+
+def register():
+    for c in __classes__:
+        bpy.utils.register_class(c)
+    bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+    bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
+    export.register()
+def unregister():
+    export.unregister()
+    for c in reversed(__classes__):
+        bpy.utils.unregister_class(c)
+    bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
@@ -1,8 +1,78 @@
-import bpy
-import bmesh
-import mathutils
+from array import array
+import hashlib
+import json
+import mmap
+import operator
 import os
-import shlex
+
+import numpy as np
+
+from . import dedup
+from . import influences
+from . import profiling
+from . import records
+from . import workers
+# tokenize stays importable as parser.tokenize, benchmark.py times it
+from .records import tokenize
+
+# layout of files written by Parser.save_binary, bump BINARY_VERSION when it changes
+BINARY_MAGIC = b"XMODELC\0"
+BINARY_VERSION = 2
+BINARY_ALIGN = 64
+ARRAYS = (
+    "positions",
+    "weight_offsets",
+    "weight_bones",
+    "weight_values",
+    "face_loop_start",
+    "face_loop_total",
+    "face_objects",
+    "face_materials",
+    "loop_vertices",
+    "loop_normals",
+    "loop_uvs",
+    "loop_colors",
+    "bone_parents",
+    "bone_offsets",
+    "bone_axes",
+    "bone_scales",
+)
+
+# Parser attribute holding the count of each section
+COUNTS = {
+    "bones": "numbones",
+    "vertices": "numverts",
+    "faces": "numfaces",
+    "objects": "numobjects",
+    "materials": "nummaterials",
+}
+
+# how uvs outside of 0-1 are brought into Blender, see convert_uvs
+UV_POLICIES = ('WRAP', 'CLAMP', 'PRESERVE')
+
+def convert_uvs(uvs, policy='WRAP'):
+    # (L, 2) uvs as written in the file -> Blender uvs, v flipped. WRAP folds
+    # them into 0-1 with whole numbers above 0 landing on 1, the far edge of
+    # the tile, CLAMP clips them to 0-1 and PRESERVE keeps tiled coordinates
+    uvs = np.asarray(uvs, dtype=np.float64).reshape(-1, 2)
+    if policy == 'WRAP':
+        w = uvs - np.floor(uvs)
+        uvs = np.where((w == 0.0) & (uvs > 0.0), 1.0, w)
+    elif policy == 'CLAMP':
+        uvs = np.clip(uvs, 0.0, 1.0)
+    elif policy != 'PRESERVE':
+        raise Exception("Unknown uv policy %s" % (policy))
+    out = np.empty(uvs.shape, dtype=np.float32)
+    out[:, 0] = uvs[:, 0]
+    out[:, 1] = 1.0 - uvs[:, 1]
+    return out
+
+class Vector(tuple):
+    # read-only stand-in for mathutils.Vector so the parser runs without bpy
+    __slots__ = ()
+    x = property(operator.itemgetter(0))
+    y = property(operator.itemgetter(1))
+    z = property(operator.itemgetter(2))
 
 class Material():
     def __init__(self, index, name, path):
@@ -10,17 +80,41 @@ class Material():
         self.name = name
         self.texture_path = path
 
+# Object, Face, Influence, Vertex and Bone are views over the arrays of a
+# Parser, they are created on access and hold no data of their own
+
 class Object():
-    def __init__(self, index):
-        self.faces = []
+    def __init__(self, parser, index):
+        self.parser = parser
         self.index = index
-        self.name = "UnnamedObject_%d" % (index)
+        self.face_indices = np.flatnonzero(parser.face_objects == index)
+    
+    @property
+    def name(self):
+        return self.parser.object_names.get(self.index, "UnnamedObject_%d" % (self.index))
+    
+    @property
+    def faces(self):
+        return [Face(self.parser, i) for i in self.face_indices.tolist()]
 
 class Face():
-    def __init__(self, object_index, material_index):
-        self.object_index = object_index
-        self.material_index = material_index
-        self.vertex = []
+    def __init__(self, parser, index):
+        self.parser = parser
+        self.index = index
+    
+    @property
+    def object_index(self):
+        return int(self.parser.face_objects[self.index])
+    
+    @property
+    def material_index(self):
+        return int(self.parser.face_materials[self.index])
+    
+    @property
+    def vertex(self):
+        p = self.parser
+        start = p.face_loop_start[self.index]
+        return p.loop_vertices[start:start + p.face_loop_total[self.index]].tolist()
 
 class Influence():
     def __init__(self, index, weight):
@@ -28,175 +122,447 @@ class Influence():
         self.index = index
         
 class Vertex():
-    def __init__(self):
-        self.offset = mathutils.Vector()
-        self.normal = mathutils.Vector()
-        self.uv = mathutils.Vector((0, 0))
-        self.influences = []
+    def __init__(self, parser, index):
+        self.parser = parser
+        self.index = index
+    
+    @property
+    def offset(self):
+        return Vector(self.parser.positions[self.index].tolist())
+    
+    @property
+    def normal(self):
+        # the normal of the last face corner referencing this vertex
+        l = self.parser.vertex_last_loop()[self.index]
+        if l == -1:
+            return Vector((0.0, 0.0, 0.0))
+        return Vector(self.parser.loop_normals[l].tolist())
+    
+    @property
+    def uv(self):
+        l = self.parser.vertex_last_loop()[self.index]
+        if l == -1:
+            return Vector((0.0, 0.0))
+        return Vector(convert_uvs(self.parser.loop_uvs[l]).ravel().tolist())
+    
+    @property
+    def influences(self):
+        p = self.parser
+        s = slice(p.weight_offsets[self.index], p.weight_offsets[self.index + 1])
+        return [Influence(b, w) for b, w in zip(p.weight_bones[s].tolist(), p.weight_values[s].tolist())]
+
+class Vertices():
+    def __init__(self, parser):
+        self.parser = parser
+    
+    def __len__(self):
+        return len(self.parser.positions)
+    
+    def __getitem__(self, index):
+        n = len(self)
+        if isinstance(index, slice):
+            return [Vertex(self.parser, i) for i in range(*index.indices(n))]
+        if index < 0:
+            index += n
+        if index < 0 or index >= n:
+            raise IndexError("vertex index out of range")
+        return Vertex(self.parser, index)
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Vertex(self.parser, i)
         
 class Bone():
-    def __init__(self, index, parent, tag):
-        self.tag = tag
+    def __init__(self, parser, index):
+        self.parser = parser
         self.index = index
-        self.parent = parent
-        self.offset = mathutils.Vector()
-        self.x = mathutils.Vector()
-        self.y = mathutils.Vector()
-        self.z = mathutils.Vector()
-        self.scale = mathutils.Vector((1, 1, 1))
-        self.vertices = []
+        self.tag = parser.bone_names[index]
+        self.parent = int(parser.bone_parents[index])
+    
+    @property
+    def offset(self):
+        return Vector(self.parser.bone_offsets[self.index].tolist())
+    
+    @property
+    def x(self):
+        return Vector(self.parser.bone_axes[self.index, 0].tolist())
+    
+    @property
+    def y(self):
+        return Vector(self.parser.bone_axes[self.index, 1].tolist())
+    
+    @property
+    def z(self):
+        return Vector(self.parser.bone_axes[self.index, 2].tolist())
+    
+    @property
+    def scale(self):
+        return Vector(self.parser.bone_scales[self.index].tolist())
+    
+    @property
+    def vertices(self):
+        p = self.parser
+        w = np.flatnonzero(p.weight_bones == self.index)
+        v = np.searchsorted(p.weight_offsets, w, side="right") - 1
+        return [Vertex(p, i) for i in v.tolist()]
+
+def to_array(buf, dtype, width=None):
+    a = np.frombuffer(buf, dtype=dtype).copy()
+    if width is not None:
+        a = a.reshape(-1, width)
+    return a
 
 class Parser():
     
+    # Everything read from the file ends up in flat arrays:
+    #
+    #   positions                       (N, 3) float32
+    #   weight_offsets                  (N + 1) int32, CSR rows into
+    #   weight_bones, weight_values     (W) int32 / float32
+    #   face_loop_start, face_loop_total, face_objects, face_materials  (F) int32
+    #   loop_vertices                   (L) int32, vertex index per face corner
+    #   loop_normals, loop_uvs, loop_colors  (L, 3) / (L, 2) / (L, 4) float32,
+    #                                   uvs as written in the file, see convert_uvs
+    #   bone_names, bone_parents        (B) list / int32
+    #   bone_offsets, bone_axes, bone_scales  (B, 3) / (B, 3, 3) / (B, 3) float32
+    #
+    # bones, vertices and objects are views over those.
+    
     def __init__(self):
         self.numbones = -1
+        self.numverts = -1
         self.numfaces = -1
-        self.bones = []
-        self.vertices = []
+        self.numobjects = -1
+        self.nummaterials = -1
+        self.sections = None
+        self.object_filter = None
         self.materials = []
-        self.objects = []
-        self.current_object = None
-        self.current_face = None
+        self.object_names = {}
+        self.bone_names = []
         self.filepath = None
+        self.vertices = Vertices(self)
+        self.reset_buffers()
+        self.finish()
     
-    def error(self, msg):
-            raise Exception(msg)    
+    def reset_buffers(self):
+        self._positions = array("f")
+        self._weight_offsets = array("i")
+        self._weight_bones = array("i")
+        self._weight_values = array("f")
+        self._face_loop_start = array("i")
+        self._face_objects = array("i")
+        self._face_materials = array("i")
+        self._loop_vertices = array("i")
+        self._loop_normals = array("f")
+        self._loop_uvs = array("f")
+        self._loop_colors = array("f")
+        self._bone_parents = array("i")
+        self._bone_offsets = array("f")
+        self._bone_axes = array("f")
+        self._bone_scales = array("f")
     
-    def parse_version(self, ver):
-        if ver != "6":
-            self.error("Invalid version %s" % (ver))
+    def finish(self):
+        # move the parse buffers into numpy arrays and rebuild the views
+        self._weight_offsets.append(len(self._weight_bones))
+        self.positions = to_array(self._positions, np.float32, 3)
+        self.weight_offsets = to_array(self._weight_offsets, np.int32)
+        self.weight_bones = to_array(self._weight_bones, np.int32)
+        self.weight_values = to_array(self._weight_values, np.float32)
+        self.face_loop_start = to_array(self._face_loop_start, np.int32)
+        self.face_objects = to_array(self._face_objects, np.int32)
+        self.face_materials = to_array(self._face_materials, np.int32)
+        self.loop_vertices = to_array(self._loop_vertices, np.int32)
+        self.loop_normals = to_array(self._loop_normals, np.float32, 3)
+        self.loop_uvs = to_array(self._loop_uvs, np.float32, 2)
+        self.loop_colors = to_array(self._loop_colors, np.float32, 4)
+        self.bone_parents = to_array(self._bone_parents, np.int32)
+        self.bone_offsets = to_array(self._bone_offsets, np.float32, 3)
+        self.bone_axes = to_array(self._bone_axes, np.float32, 9).reshape(-1, 3, 3)
+        self.bone_scales = to_array(self._bone_scales, np.float32, 3)
+        self.reset_buffers()
+        self.face_loop_total = np.diff(np.append(self.face_loop_start, len(self.loop_vertices))).astype(np.int32)
+        self.build_views()
     
-    def parse_numfaces(self, nf):
-        self.numfaces = int(nf)
-            
-    def parse_numbones(self, nb):
-        self.numbones = int(nb)
-        
-    def parse_vert(self, vertex_index):
-        if self.numfaces == -1: # vertex definition
-            self.vertices.append(Vertex())
-            self.current_object = self.vertices[-1]
-        else:
-            self.current_face.vertex.append(int(vertex_index))
-            self.current_object = self.vertices[int(vertex_index)]
-            #print("setting vert to %d" % (int(vertex_index)))
-    
-    def parse_set_current_face_index(self, object_index_str, material_index, c1, c2):
-        
-        obj_idx = int(object_index_str)
-        
-        if obj_idx >= len(self.objects):
-            self.objects.append(Object(obj_idx))
-        obj = self.objects[-1]
-        obj.faces.append(Face(obj_idx, int(material_index)))
-        self.current_face = obj.faces[-1]
-    
-    def parse_bone_definition(self, index, parent, tag):
-        self.bones.append(Bone(int(index), int(parent), tag[1:-1]))
-        
-    def parse_set_current_bone_index(self, index):
-        self.current_object = self.bones[int(index)]
-        
-    def parse_vector_string(self, x, y, z):
-        v = mathutils.Vector((0, 0, 0))
-        v[:] = float(x[0:-1]), float(y[0:-1]), float(z[0:-1])
-        return v
-        
-    def parse_offset(self, x, y, z):
-        self.current_object.offset = self.parse_vector_string(x, y, z)
-        
-    def parse_x(self, x, y, z):
-        self.current_object.x = self.parse_vector_string(x, y, z)
+    def build_views(self):
+        self._vertex_last_loop = None
+        self.bones = [Bone(self, i) for i in range(len(self.bone_names))]
+        self.objects = [Object(self, i) for i in np.unique(self.face_objects).tolist()]
+    
+    def save_binary(self, path):
+        # header (json) followed by the raw arrays, each aligned for memory mapping
+        header = {
+            "numbones": self.numbones,
+            "numverts": self.numverts,
+            "numfaces": self.numfaces,
+            "numobjects": self.numobjects,
+            "nummaterials": self.nummaterials,
+            "bone_names": self.bone_names,
+            "object_names": sorted(self.object_names.items()),
+            "materials": [(m.index, m.name, m.texture_path) for m in self.materials],
+            "arrays": {},
+        }
+        offset = 0
+        for name in ARRAYS:
+            a = getattr(self, name)
+            header["arrays"][name] = (a.dtype.str, a.shape, offset)
+            offset += -(-a.nbytes // BINARY_ALIGN) * BINARY_ALIGN
         
-    def parse_y(self, x, y, z):
-        self.current_object.y = self.parse_vector_string(x, y, z)
+        data = json.dumps(header).encode("utf-8")
+        start = len(BINARY_MAGIC) + 8 + len(data)
+        start += -start % BINARY_ALIGN
+        with open(path, "wb") as f:
+            f.write(BINARY_MAGIC)
+            f.write(BINARY_VERSION.to_bytes(4, "little"))
+            f.write(len(data).to_bytes(4, "little"))
+            f.write(data)
+            for name in ARRAYS:
+                f.write(b"\0" * (start + header["arrays"][name][2] - f.tell()))
+                f.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+    
+    def load_binary(self, path):
+        # memory maps a file written by save_binary, the arrays are read-only views into it
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        n = len(BINARY_MAGIC)
+        if buf[:n] != BINARY_MAGIC:
+            self.error("%s is not a binary xmodel" % (path))
+        version = int.from_bytes(buf[n:n + 4], "little")
+        if version != BINARY_VERSION:
+            self.error("Unsupported binary xmodel version %d" % (version))
+        size = int.from_bytes(buf[n + 4:n + 8], "little")
+        header = json.loads(buf[n + 8:n + 8 + size].decode("utf-8"))
+        start = n + 8 + size
+        start += -start % BINARY_ALIGN
         
-    def parse_z(self, x, y, z):
-        self.current_object.z = self.parse_vector_string(x, y, z)
+        self.filepath = path
+        self.numbones = header["numbones"]
+        self.numverts = header["numverts"]
+        self.numfaces = header["numfaces"]
+        self.numobjects = header["numobjects"]
+        self.nummaterials = header["nummaterials"]
+        self.bone_names = header["bone_names"]
+        self.object_names = {i: name for i, name in header["object_names"]}
+        self.materials = [Material(i, name, texture) for i, name, texture in header["materials"]]
+        for name in ARRAYS:
+            dtype, shape, offset = header["arrays"][name]
+            count = int(np.prod(shape))
+            if count == 0:
+                a = np.empty(shape, dtype=dtype)
+            else:
+                a = np.frombuffer(buf, dtype=dtype, count=count, offset=start + offset).reshape(shape)
+            setattr(self, name, a)
+        self._mmap = buf
+        self.build_views()
     
-    def parse_object(self, index, name):
-        self.objects[int(index)].name = name[1:-1]    
+    @property
+    def faces(self):
+        # (F, 3) vertex indices, only valid when every face is a triangle
+        if np.any(self.face_loop_total != 3):
+            self.error("Not all faces are triangles")
+        return self.loop_vertices.reshape(-1, 3)
     
-    def parse_normal(self, x, y, z):
-        if not isinstance(self.current_object, Vertex):
-            self.error("Current object is not of type Vertex")
-        self.current_object.normal = mathutils.Vector((float(x), float(y), float(z)))
-        
-    def parse_uv(self, c, u, v):
-        if not isinstance(self.current_object, Vertex):
-            self.error("Current object is not of type Vertex")
-        uv = mathutils.Vector((float(u), float(v)))
-        
-        while uv.x < 0.0:
-            uv.x += 1.0
-        while uv.y < 1.0:
-            uv.y += 1.0
-            
-        while uv.x > 1.0:
-            uv.x -= 1.0
-        while uv.y > 1.0:
-            uv.y -= 1.0
-        self.current_object.uv = mathutils.Vector((uv.x, 1.0 - uv.y))
-        #print("setting uv to %f %f" % (float(u), float(v)))
-    
-    def parse_material(self, index, material, shading, image):
-        name = material[1:-1]
-        path = image[1:-1]
+    def face_loops(self, face_indices):
+        # face corner indices of the given faces, in face order
+        return influences.ranges(self.face_loop_start[face_indices], self.face_loop_total[face_indices])
+
+    def vertex_weights(self, vertex_indices):
+        # the influences of the given vertices as (offsets, bones, weights), laid
+        # out like weight_offsets/weight_bones/weight_values
+        return influences.take((self.weight_offsets, self.weight_bones, self.weight_values), vertex_indices)
+
+    def weight_groups(self, vertex_indices):
+        # groups the influences of the given vertices by bone and weight value,
+        # yields (bone index, weight, positions in vertex_indices) so a vertex
+        # group can be filled with one add per distinct weight
+        offsets, bones, weights = self.vertex_weights(vertex_indices)
+        rows = np.repeat(np.arange(len(vertex_indices)), np.diff(offsets))
+
+        order = np.lexsort((weights, bones))
+        bones = bones[order]
+        weights = weights[order]
+        rows = rows[order]
+        split = np.flatnonzero((bones[1:] != bones[:-1]) | (weights[1:] != weights[:-1])) + 1
+        for s, e in zip(np.append(0, split).tolist(), np.append(split, len(rows)).tolist()):
+            if s == e:
+                continue
+            yield int(bones[s]), float(weights[s]), rows[s:e]
+
+    def skeleton_key(self, epsilon=dedup.DEFAULT_EPSILON):
+        # hash of the bone names, parents and matrices, equal for files that
+        # share a skeleton
+        h = hashlib.blake2b(digest_size=16)
+        h.update(json.dumps(self.bone_names).encode("utf-8"))
+        h.update(self.bone_parents.astype(np.int32).tobytes())
+        mats = np.concatenate((self.bone_offsets, self.bone_axes.reshape(-1, 9)), axis=1)
+        h.update(dedup.quantize(mats, epsilon).tobytes())
+        return h.hexdigest()
+    
+    def material_table(self):
+        # MATERIAL index -> Material
+        return {m.index: m for m in self.materials}
+    
+    def vertex_last_loop(self):
+        # index of the last face corner referencing each vertex, -1 for none
+        if self._vertex_last_loop is None:
+            last = np.full(len(self.positions), -1, dtype=np.int64)
+            rev = self.loop_vertices[::-1]
+            verts, first = np.unique(rev, return_index=True)
+            last[verts] = len(rev) - 1 - first
+            self._vertex_last_loop = last
+        return self._vertex_last_loop
+    
+    def error(self, msg):
+            raise records.ParseError(msg)    
+    
+    def add_version(self, r):
+        if r.version != 6:
+            self.error("Invalid version %d" % (r.version))
+    
+    def add_count(self, r):
+        setattr(self, COUNTS[r.section], r.count)
+    
+    def add_bone_definition(self, r):
+        self.bone_names.append(r.name)
+        self._bone_parents.append(r.parent)
+        self._bone_offsets.extend((0.0, 0.0, 0.0))
+        self._bone_axes.extend((0.0,) * 9)
+        self._bone_scales.extend((1.0, 1.0, 1.0))
+    
+    def add_bone_pose(self, r):
+        i = r.index
+        if i < 0 or i >= len(self.bone_names):
+            self.error("Bone index %d out of range" % (i))
+        self._bone_offsets[i * 3:i * 3 + 3] = array("f", r.offset)
+        self._bone_scales[i * 3:i * 3 + 3] = array("f", r.scale)
+        self._bone_axes[i * 9:i * 9 + 9] = array("f", r.x + r.y + r.z)
+    
+    def add_vertex(self, r):
+        # vertices are numbered in file order, the VERT index is not used
+        self._positions.extend(r.offset)
+        self._weight_offsets.append(len(self._weight_bones))
+        for bone, weight in r.influences:
+            self._weight_bones.append(bone)
+            self._weight_values.append(weight)
+    
+    def add_triangle(self, r):
+        self._face_loop_start.append(len(self._loop_vertices))
+        self._face_objects.append(r.object_index)
+        self._face_materials.append(r.material_index)
+        for c in r.corners:
+            self._loop_vertices.append(c.vertex)
+            self._loop_normals.extend(c.normal)
+            self._loop_uvs.extend(c.uv)
+            self._loop_colors.extend(c.color)
+    
+    def add_object(self, r):
+        self.object_names[r.index] = r.name
+    
+    def add_material(self, r):
         # nvm, just manually fix the materials
         #if len(path) != 0:
         #    path = path.split("color:")[1].replace("\\\\", "/") # get path after color:
         #    path = os.path.dirname(self.filepath) + "/" + path
         #    path = path.replace("~-g", "")
-        m = Material(int(index), name, path)
-        self.materials.append(m)
-    
-    def parse_vertex_bone_weight(self, bone_index, weight):
-        if not isinstance(self.current_object, Vertex):
-            self.error("Current object is not of type Vertex")
-        bi = int(bone_index)
-        b = self.bones[bi]
-        self.current_object.influences.append(Influence(bi, float(weight)))
-        b.vertices.append(self.current_object)
-        
-    def read_file(self, path):
+        self.materials.append(Material(r.index, r.name, r.image))
+    
+    def add_records(self, recs):
+        handlers = {
+            records.Version: self.add_version,
+            records.Count: self.add_count,
+            records.BoneDefinition: self.add_bone_definition,
+            records.BonePose: self.add_bone_pose,
+            records.Vertex: self.add_vertex,
+            records.Triangle: self.add_triangle,
+            records.Object: self.add_object,
+            records.Material: self.add_material,
+        }
+        for r in recs:
+            handlers[type(r)](r)
+    
+    def read_file(self, path, sections=None, objects=None, cancel=None):
+        # sections limits parsing to some of SECTIONS, objects to the faces of
+        # the given object indices, everything else is skipped without tokenizing.
+        # Setting the cancel event from another thread stops reading early
         self.filepath = path
-        with open(path, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
+        self.sections = sections
+        self.object_filter = None if objects is None else set(objects)
+        reader = records.Reader(sections, objects)
+        with profiling.stage("parse"):
+            self.add_records(reader.read(records.read_lines(path, cancel=cancel)))
+        with profiling.stage("finish"):
+            self.finish()
+        profiling.count("bones", len(self.bone_names))
+        profiling.count("vertices", len(self.positions))
+        profiling.count("faces", len(self.face_loop_start))
+        profiling.count("influences", len(self.weight_bones))
+
+def read(path, sections=None, objects=None):
+    # Parser.read_file as a function that worker processes can run
+    p = Parser()
+    p.read_file(path, sections, objects)
+    return p
+
+# a file this large is worth starting a worker process for
+PARALLEL_MIN_BYTES = 1 << 20
+
+def read_files(work, jobs=0):
+    # read() of every (path, sections, objects) in work, Parsers in order.
+    # When at least two files are large enough they go to worker processes
+    # while the small ones are parsed here in the meantime. jobs 0 means one
+    # worker per cpu
+    jobs = workers.count(jobs)
+    large = [i for i, (path, sections, objects) in enumerate(work) if os.path.getsize(path) >= PARALLEL_MIN_BYTES]
+    if jobs < 2 or len(large) < 2:
+        return [read(*w) for w in work]
+    with workers.Pool(min(jobs, len(large))) as pool:
+        pending = {i: pool.submit(read, *work[i]) for i in large}
+        out = [None if i in pending else read(*w) for i, w in enumerate(work)]
+        for i, p in pending.items():
+            out[i] = p()
+        return out
+
+def peek(path, chunk_size=1 << 24):
+    # header summary for asset browsers. The raw bytes are split at NUM* lines
+    # and the vertex and face sections are never decoded or tokenized.
+    p = Parser()
+    reader = records.Reader(("bones", "objects", "materials"))
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk_size)
+            data = rest + block
+            rest = b""
+            if block:
+                cut = data.rfind(b"\n") + 1
+                data, rest = data[:cut], data[cut:]
             
-            for l in lines:
-                if len(l) == 0:
-                    continue
-                if l[0] == '/' and l[1] == '/':
-                    continue
-                #sp = l.strip().split(" ")
-                sp = shlex.split(l.strip(), posix=False)
-                if len(sp) == 0:
-                    continue
-                
-                key = sp[0]
-                args = sp[1:]
-                parsers = {
-                    "VERSION": self.parse_version,
-                    "NUMBONES": self.parse_numbones,
-                    "OFFSET": self.parse_offset,
-                    "X": self.parse_x,
-                    "Y": self.parse_y,
-                    "Z": self.parse_z,
-                    "NORMAL": self.parse_normal,
-                    "UV": self.parse_uv,
-                    "MATERIAL": self.parse_material,
-                    "TRI": self.parse_set_current_face_index,
-                    "BONE": {
-                        4: self.parse_bone_definition,
-                        2: self.parse_set_current_bone_index,
-                        3: self.parse_vertex_bone_weight,
-                    },
-                    "OBJECT": self.parse_object,
-                    "NUMFACES": self.parse_numfaces,
-                    "VERT": self.parse_vert,
-                }
-                if key in parsers:
-                    if callable(parsers[key]):
-                        parsers[key](*args)
-                    else:
-                        parsers[key][len(sp)](*args)
\ No newline at end of file
+            starts = [0]
+            i = data.find(b"\nNUM")
+            while i != -1:
+                starts.append(i + 1)
+                i = data.find(b"\nNUM", i + 1)
+            starts.append(len(data))
+            for s, e in zip(starts[:-1], starts[1:]):
+                if data.startswith(b"NUM", s):
+                    nl = data.find(b"\n", s, e)
+                    nl = e if nl == -1 else nl + 1
+                    p.add_records(reader.feed([data[s:nl].decode("utf-8")]))
+                    s = nl
+                if not reader.skipping():
+                    p.add_records(reader.feed(data[s:e].decode("utf-8").splitlines()))
+                else:
+                    # keeps the line numbers of later errors right
+                    reader.lineno += data.count(b"\n", s, e)
+            if not block:
+                break
+    p.add_records(reader.close())
+    return {
+        "numbones": p.numbones,
+        "numverts": p.numverts,
+        "numfaces": p.numfaces,
+        "numobjects": p.numobjects,
+        "nummaterials": p.nummaterials,
+        "bones": p.bone_names,
+        "objects": sorted(p.object_names.items()),
+        "materials": [m.name for m in p.materials],
+    }
@@ -0,0 +1,143 @@
+# Opt-in per-stage timing for the parser, importer and exporter.
+#
+# Code marks its stages with `with profiling.stage("name", count):`. Unless a
+# Profiler is active (see enabled()) that returns a shared no-op object, so
+# the marks cost a function call per stage and nothing else.
+#
+# XMODEL_PROFILE=1 turns profiling on for every import/export, XMODEL_PROFILE=cprofile
+# additionally captures a cProfile of the whole run.
+
+import contextlib
+import cProfile
+import json
+import os
+import time
+
+ENV = "XMODEL_PROFILE"
+
+class NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+class NullProfiler():
+    enabled = False
+
+    def stage(self, name, count=0):
+        return NULL_STAGE
+
+    def count(self, name, n):
+        pass
+
+NULL = NullProfiler()
+
+class Stage():
+    __slots__ = ("profiler", "name", "count", "start")
+
+    def __init__(self, profiler, name, count):
+        self.profiler = profiler
+        self.name = name
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.count)
+        return False
+
+class Profiler():
+    enabled = True
+
+    def __init__(self, cprofile=False):
+        self.stages = {} # name -> [seconds, calls, items], in first-seen order
+        self.counts = {}
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.start = None
+        self.seconds = 0.0
+
+    def stage(self, name, count=0):
+        return Stage(self, name, count)
+
+    def record(self, name, seconds, count):
+        s = self.stages.get(name)
+        if s is None:
+            s = self.stages[name] = [0.0, 0, 0]
+        s[0] += seconds
+        s[1] += 1
+        s[2] += count
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def begin(self):
+        self.start = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def end(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.seconds = time.perf_counter() - self.start
+
+    def summary(self):
+        parts = ["%s %.3fs" % (name, s[0]) for name, s in self.stages.items()]
+        return "%.3fs total: %s" % (self.seconds, ", ".join(parts))
+
+    def to_dict(self):
+        return {
+            "seconds": self.seconds,
+            "stages": [
+                {"name": name, "seconds": s[0], "calls": s[1], "items": s[2]}
+                for name, s in self.stages.items()
+            ],
+            "counts": self.counts,
+        }
+
+    def write(self, path, **extra):
+        # path.profile.json with the stages, path.prof with the cProfile capture
+        data = self.to_dict()
+        data.update(extra)
+        with open(path + ".profile.json", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(path + ".prof")
+
+active = NULL
+
+def stage(name, count=0):
+    return active.stage(name, count)
+
+def count(name, n):
+    active.count(name, n)
+
+def create(enabled=False, cprofile=False):
+    # a Profiler when asked for by the caller or by XMODEL_PROFILE, NULL otherwise
+    env = os.environ.get(ENV, "").strip().lower()
+    if env == "cprofile":
+        enabled = cprofile = True
+    elif env not in ("", "0"):
+        enabled = True
+    if not enabled and not cprofile:
+        return NULL
+    return Profiler(cprofile)
+
+@contextlib.contextmanager
+def enabled(profiler):
+    global active
+    if not profiler.enabled:
+        yield profiler
+        return
+    previous = active
+    active = profiler
+    profiler.begin()
+    try:
+        yield profiler
+    finally:
+        profiler.end()
+        active = previous
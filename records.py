@@ -0,0 +1,369 @@
+# Streaming reader for .xmodel_export files.
+#
+# records(path) yields the file as typed records, one per bone definition,
+# bone pose, vertex, triangle, object and material, while reading it in fixed
+# size buffers. Memory stays flat whatever the size of the file, only the
+# record being collected is held. Parser builds its arrays from these.
+#
+#   for r in records.records("model.xmodel_export", sections=("bones",)):
+#       if isinstance(r, records.BoneDefinition):
+#           print(r.index, r.parent, r.name)
+
+import re
+
+# quoted names ("tag_origin") are kept together with their quotes, everything
+# else is split on whitespace, matching shlex.split(line, posix=False)
+_token_re = re.compile(r'"[^"]*"|\'[^\']*\'|["\']|[^\s"\']\S*')
+
+# sections of the file, each starts with its NUM* line
+SECTIONS = ("bones", "vertices", "faces", "objects", "materials")
+
+BUFFER_SIZE = 1 << 20
+
+def tokenize(line):
+    if not '"' in line and not "'" in line:
+        return line.split()
+    tokens = _token_re.findall(line)
+    for t in tokens:
+        if len(t) == 1 and t in "\"'":
+            raise ValueError("No closing quotation")
+    return tokens
+
+def vector(x, y, z):
+    # OFFSET/X/Y/Z/SCALE components carry a trailing comma
+    return float(x[0:-1]), float(y[0:-1]), float(z[0:-1])
+
+# every record has the line it started on as line, None when it was not read
+# from a file
+
+class Version():
+    __slots__ = ("version", "line")
+    def __init__(self, version, line=None):
+        self.version = version
+        self.line = line
+
+class Count():
+    # a NUM* line, section is one of SECTIONS
+    __slots__ = ("section", "count", "line")
+    def __init__(self, section, count, line=None):
+        self.section = section
+        self.count = count
+        self.line = line
+
+class BoneDefinition():
+    __slots__ = ("index", "parent", "name", "line")
+    def __init__(self, index, parent, name, line=None):
+        self.index = index
+        self.parent = parent
+        self.name = name
+        self.line = line
+
+class BonePose():
+    # x, y and z are the rows of the bone's rotation
+    __slots__ = ("index", "offset", "scale", "x", "y", "z", "line")
+    def __init__(self, index, line=None):
+        self.index = index
+        self.offset = (0.0, 0.0, 0.0)
+        self.scale = (1.0, 1.0, 1.0)
+        self.x = (0.0, 0.0, 0.0)
+        self.y = (0.0, 0.0, 0.0)
+        self.z = (0.0, 0.0, 0.0)
+        self.line = line
+
+class Vertex():
+    # influences is a list of (bone index, weight)
+    __slots__ = ("index", "offset", "influences", "line")
+    def __init__(self, index, line=None):
+        self.index = index
+        self.offset = (0.0, 0.0, 0.0)
+        self.influences = []
+        self.line = line
+
+class Corner():
+    # uv is as written in the file, not wrapped or flipped
+    __slots__ = ("vertex", "normal", "color", "uv")
+    def __init__(self, vertex):
+        self.vertex = vertex
+        self.normal = (0.0, 0.0, 0.0)
+        self.color = (1.0, 1.0, 1.0, 1.0)
+        self.uv = (0.0, 0.0)
+
+class Triangle():
+    __slots__ = ("object_index", "material_index", "corners", "line")
+    def __init__(self, object_index, material_index, line=None):
+        self.object_index = object_index
+        self.material_index = material_index
+        self.corners = []
+        self.line = line
+
+class Object():
+    __slots__ = ("index", "name", "line")
+    def __init__(self, index, name, line=None):
+        self.index = index
+        self.name = name
+        self.line = line
+
+class Material():
+    # properties holds the lines following MATERIAL (COLOR, SPECULARCOLOR, ...)
+    # as keyword -> list of tokens
+    __slots__ = ("index", "name", "shading", "image", "properties", "line")
+    def __init__(self, index, name, shading, image, line=None):
+        self.index = index
+        self.name = name
+        self.shading = shading
+        self.image = image
+        self.properties = {}
+        self.line = line
+
+def read_lines(path, buffer_size=BUFFER_SIZE, cancel=None):
+    # lines of the file, read buffer_size bytes at a time. A line cut by the
+    # end of a buffer is carried over to the next one. cancel is an optional
+    # threading.Event that ends the lines early once set
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            if cancel is not None and cancel.is_set():
+                return
+            block = f.read(buffer_size)
+            if not block:
+                break
+            data = rest + block
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut:
+                yield from data[:cut].decode("utf-8").splitlines()
+    if rest:
+        yield from rest.decode("utf-8").splitlines()
+
+class ParseError(Exception):
+    # a line that could not be read, line and text are None when not known
+    def __init__(self, message, line=None, text=None):
+        self.message = message
+        self.line = line
+        self.text = text
+        if line is not None:
+            message = "line %d: %s (%s)" % (line, message, text)
+        super().__init__(message)
+
+class Reader():
+    # turns lines into records. A record spanning several lines (bone pose,
+    # vertex, triangle, material) is handed out once the next one starts
+    def __init__(self, sections=None, objects=None):
+        # sections limits reading to some of SECTIONS, objects to the triangles
+        # of the given object indices, everything else is skipped without tokenizing
+        self.sections = sections
+        self.object_filter = None if objects is None else set(objects)
+        self.in_faces = False
+        self.skip_until = None
+        self.stopped = False
+        self.pending = None
+        self.corner = None
+        self.out = []
+        self.lineno = 0
+        self.numbones = 0
+        self.handlers = {
+            "VERSION": self.read_version,
+            "NUMBONES": self.read_numbones,
+            "OFFSET": self.read_offset,
+            "SCALE": self.read_scale,
+            "X": self.read_x,
+            "Y": self.read_y,
+            "Z": self.read_z,
+            "NORMAL": self.read_normal,
+            "UV": self.read_uv,
+            "MATERIAL": self.read_material,
+            "TRI": self.read_tri,
+            "BONE": self.read_bone,
+            "OBJECT": self.read_object,
+            "NUMVERTS": self.read_numverts,
+            "NUMFACES": self.read_numfaces,
+            "NUMOBJECTS": self.read_numobjects,
+            "NUMMATERIALS": self.read_nummaterials,
+            "VERT": self.read_vert,
+            "COLOR": self.read_color,
+        }
+
+    def error(self, msg):
+        raise ParseError(msg)
+
+    def read(self, lines):
+        yield from self.feed(lines)
+        yield from self.close()
+
+    def feed(self, lines):
+        # lineno counts every line fed, also skipped ones
+        handlers = self.handlers
+        out = self.out
+        for self.lineno, l in enumerate(lines, self.lineno + 1):
+            if self.skip_until is not None:
+                if self.stopped:
+                    break
+                if not l.lstrip().startswith(self.skip_until):
+                    continue
+                self.skip_until = None
+            if l.startswith("//"):
+                continue
+            try:
+                sp = tokenize(l)
+                if len(sp) == 0:
+                    continue
+
+                h = handlers.get(sp[0])
+                if h is None:
+                    if type(self.pending) is Material:
+                        self.pending.properties[sp[0]] = sp[1:]
+                    continue
+                h(*sp[1:])
+            except ParseError as e:
+                raise ParseError(e.message, self.lineno, l.strip()) from None
+            except (ValueError, TypeError) as e:
+                # malformed numbers and wrong argument counts
+                raise ParseError("%s: %s" % (type(e).__name__, str(e)), self.lineno, l.strip()) from e
+            if out:
+                yield from out
+                out.clear()
+
+    def close(self):
+        # the record still being collected at the end of the input
+        self.emit()
+        yield from self.out
+        self.out.clear()
+
+    def emit(self):
+        if self.pending is not None:
+            self.out.append(self.pending)
+            self.pending = None
+        self.corner = None
+
+    def skipping(self):
+        return self.skip_until is not None
+
+    def read_version(self, ver):
+        self.emit()
+        self.out.append(Version(int(ver), self.lineno))
+
+    def enter_section(self, name, count):
+        self.emit()
+        self.out.append(Count(name, int(count), self.lineno))
+        # lines of sections that were not asked for are skipped up to the next NUM* line
+        if self.sections is not None and not name in self.sections:
+            self.skip_until = ("NUM",)
+            # nothing wanted further down, reading can stop here
+            self.stopped = not any(s in self.sections for s in SECTIONS[SECTIONS.index(name):])
+
+    def read_numbones(self, n):
+        self.enter_section("bones", n)
+
+    def read_numverts(self, n):
+        self.enter_section("vertices", n)
+
+    def read_numfaces(self, n):
+        self.in_faces = True
+        self.enter_section("faces", n)
+
+    def read_numobjects(self, n):
+        self.enter_section("objects", n)
+
+    def read_nummaterials(self, n):
+        self.enter_section("materials", n)
+
+    def read_bone(self, *args):
+        # BONE lines differ by their number of arguments
+        if len(args) == 2:
+            self.read_vertex_bone_weight(*args)
+        elif len(args) == 3:
+            self.read_bone_definition(*args)
+        elif len(args) == 1:
+            self.read_bone_pose(*args)
+        else:
+            self.error("Invalid BONE line")
+
+    def read_bone_definition(self, index, parent, tag):
+        self.emit()
+        self.out.append(BoneDefinition(int(index), int(parent), tag[1:-1], self.lineno))
+        self.numbones += 1
+
+    def read_bone_pose(self, index):
+        self.emit()
+        i = int(index)
+        if i < 0 or i >= self.numbones:
+            self.error("Bone index %d out of range" % (i))
+        self.pending = BonePose(i, self.lineno)
+
+    def current_pose(self):
+        if type(self.pending) is not BonePose:
+            self.error("Current object is not of type Bone")
+        return self.pending
+
+    def read_offset(self, x, y, z):
+        if type(self.pending) is Vertex:
+            self.pending.offset = vector(x, y, z)
+        else:
+            self.current_pose().offset = vector(x, y, z)
+
+    def read_scale(self, x, y, z):
+        self.current_pose().scale = vector(x, y, z)
+
+    def read_x(self, x, y, z):
+        self.current_pose().x = vector(x, y, z)
+
+    def read_y(self, x, y, z):
+        self.current_pose().y = vector(x, y, z)
+
+    def read_z(self, x, y, z):
+        self.current_pose().z = vector(x, y, z)
+
+    def read_vert(self, vertex_index):
+        if not self.in_faces: # vertex definition
+            self.emit()
+            self.pending = Vertex(int(vertex_index), self.lineno)
+            return
+        if type(self.pending) is not Triangle:
+            self.error("VERT outside of a TRI")
+        self.corner = Corner(int(vertex_index))
+        self.pending.corners.append(self.corner)
+
+    def read_vertex_bone_weight(self, bone_index, weight):
+        if type(self.pending) is not Vertex:
+            self.error("Current object is not of type Vertex")
+        self.pending.influences.append((int(bone_index), float(weight)))
+
+    def read_tri(self, object_index, material_index, c1, c2):
+        self.emit()
+        obj_idx = int(object_index)
+        if self.object_filter is not None and not obj_idx in self.object_filter:
+            self.skip_until = ("TRI", "NUM")
+            return
+        self.pending = Triangle(obj_idx, int(material_index), self.lineno)
+
+    def read_normal(self, x, y, z):
+        if self.corner is None:
+            if type(self.pending) is not Vertex:
+                self.error("Current object is not of type Vertex")
+            return # normals are only kept per face corner
+        self.corner.normal = (float(x), float(y), float(z))
+
+    def read_color(self, r, g, b, a):
+        if self.corner is not None:
+            self.corner.color = (float(r), float(g), float(b), float(a))
+        elif type(self.pending) is Material:
+            self.pending.properties["COLOR"] = [r, g, b, a]
+
+    def read_uv(self, c, u, v):
+        if self.corner is None:
+            if type(self.pending) is not Vertex:
+                self.error("Current object is not of type Vertex")
+            return
+        self.corner.uv = (float(u), float(v))
+
+    def read_object(self, index, name):
+        self.emit()
+        self.out.append(Object(int(index), name[1:-1], self.lineno))
+
+    def read_material(self, index, name, shading, image):
+        self.emit()
+        self.pending = Material(int(index), name[1:-1], shading[1:-1], image[1:-1], self.lineno)
+
+def records(path, sections=None, objects=None, buffer_size=BUFFER_SIZE):
+    reader = Reader(sections, objects)
+    yield from reader.read(read_lines(path, buffer_size))
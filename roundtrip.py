@@ -0,0 +1,301 @@
+# Round-trip and throughput checks for the parser and exporter.
+#
+# python -m io_scene_xmodel.roundtrip
+# python -m io_scene_xmodel.roundtrip model.xmodel_export --baseline baseline.json
+# python -m io_scene_xmodel.roundtrip --save-baseline baseline.json
+#
+# Every file (synthetic ones when none are given) is parsed, written out again
+# and the written file parsed back. Bones, positions, normals, uvs, weights,
+# objects and materials of both are compared corner by corner within the
+# tolerances below, so merged vertices and reordered objects do not count as
+# differences. Without bpy the objects of the parsed file go through the
+# Exporter's sections.MeshWriter (vertex merging, formatting and, when given,
+# the section cache), inside Blender through the importer and the Exporter:
+#
+# blender --background --python-expr "from io_scene_xmodel import roundtrip; roundtrip.main()"
+#
+# The throughput of every stage is compared to the baseline, a stage slower
+# than --slowdown fails. A missing baseline file is written by the run, so
+# every later run on the machine is checked, --save-baseline replaces it.
+# Exits 1 on any failure. tests/test_roundtrip.py runs the same checks with
+# pytest.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from . import benchmark
+from . import formatting
+from . import parser
+from . import sections
+from . import synthetic
+from .formatting import BlockWriter
+
+TOLERANCES = {
+    "bones": 1e-4,
+    "positions": 1e-4,
+    # Blender stores custom normals compressed
+    "normals": 2e-2,
+    "uvs": 1e-5,
+    "weights": 1e-5,
+}
+
+SLOWDOWN = 0.25
+BASELINE = os.path.join(tempfile.gettempdir(), "xmodel_roundtrip_baseline.json")
+
+# synthetic files checked when no files are given
+CASES = {
+    "small": dict(bones=8, vertices=300, triangles=500, influences=2, objects=2, materials=2, seed=1),
+    "medium": dict(bones=64, vertices=10000, triangles=20000, influences=4, objects=3, materials=2, seed=2),
+}
+
+def object_arrays(p, o):
+    # the parsed object o as the Exporter extracts a mesh: (co, normals,
+    # loop_vertices, loop_starts, loop_totals, uvs), weights and face materials
+    f = o.face_indices
+    totals = p.face_loop_total[f]
+    loops = p.face_loops(f)
+    used, loop_vertices = np.unique(p.loop_vertices[loops], return_inverse=True)
+    # the formatting code expects Blender uvs and flips them back
+    uvs = np.column_stack((p.loop_uvs[loops, 0], 1.0 - p.loop_uvs[loops, 1].astype(np.float64)))
+    arrays = (p.positions[used], p.loop_normals[loops], loop_vertices.ravel(), np.cumsum(totals) - totals, totals, uvs)
+    return arrays, p.vertex_weights(used), p.face_materials[f]
+
+def write_parsed(p, path, writer=None, objects=None):
+    # writes the parsed file p back out with the exporter's sections.MeshWriter
+    # (a default one when None), bpy free. objects picks some of p.objects,
+    # objects without faces are left out
+    if writer is None:
+        writer = sections.MeshWriter()
+    if objects is None:
+        objects = p.objects
+    arrays, weights, face_materials = [], [], []
+    for o in objects:
+        a, vw, fm = object_arrays(p, o)
+        arrays.append(a)
+        weights.append(vw)
+        face_materials.append(fm)
+    names = [o.name for o in objects]
+    if writer.cache is not None:
+        writer.cache.begin(path)
+    with open(path, "w", encoding="utf-8") as f:
+        w = BlockWriter(f)
+        w.write(formatting.HEADER)
+        formatting.write_bones(w, p.bone_names, p.bone_parents.tolist(), p.bone_offsets, p.bone_axes)
+        entries = writer.write_meshes(w, names, arrays, weights, face_materials)
+        w.write("\n")
+        formatting.write_objects(w, list(enumerate(names)))
+        formatting.write_materials(w, [(m.index, m.name, m.texture_path) for m in p.materials])
+        w.flush()
+    if writer.cache is not None:
+        writer.cache.replace(dict(zip(names, entries)))
+
+def export_blender(path, out):
+    # imports path with the operator into an empty scene and exports everything
+    import bpy
+    from . import export
+
+    bpy.ops.wm.read_homefile(use_empty=True)
+    result = bpy.ops.import_scene.xmodel_export(filepath=path)
+    if not 'FINISHED' in result:
+        raise Exception("Import of %s failed" % (path))
+    for o in bpy.data.objects:
+        o.select_set(True)
+    export.Exporter(jobs=1).export_file(out)
+
+def degenerate(vertices, totals):
+    # faces that use a vertex more than once
+    faces = np.repeat(np.arange(len(totals)), totals)
+    n = int(vertices.max()) + 1 if len(vertices) else 1
+    pairs = np.sort(faces * n + vertices)
+    out = np.zeros(len(totals), dtype=bool)
+    out[pairs[1:][pairs[1:] == pairs[:-1]] // n] = True
+    return out
+
+class Model():
+    # a parsed file reduced to what a round trip has to keep: bones sorted by
+    # name, since Blender lists them in its own order, and per object the face
+    # corners in order with their weights on those bones
+    def __init__(self, p):
+        order = sorted(range(len(p.bone_names)), key=lambda i: p.bone_names[i])
+        self.bone_names = [p.bone_names[i] for i in order]
+        self.bone_parents = [p.bone_names[p.bone_parents[i]] if p.bone_parents[i] >= 0 else None for i in order]
+        self.bone_offsets = p.bone_offsets[order]
+        self.bone_axes = p.bone_axes[order]
+        self.bone_columns = np.empty(len(order), dtype=np.int64)
+        self.bone_columns[order] = np.arange(len(order))
+        materials = {m.index: m for m in p.materials}
+        self.objects = {}
+        for o in p.objects:
+            f = o.face_indices
+            totals = p.face_loop_total[f]
+            loops = p.face_loops(f)
+            vertices = p.loop_vertices[loops]
+            # faces using a vertex twice have no normals in Blender, the file's
+            # normals are compared unit length
+            faces = np.repeat(np.arange(len(totals)), totals)
+            normals = p.loop_normals[loops].astype(np.float64)
+            length = np.linalg.norm(normals, axis=1, keepdims=True)
+            self.objects[o.name] = {
+                "totals": totals,
+                # textures are only written back when they were found on import
+                "materials": [materials[i].name if i in materials else None for i in p.face_materials[f].tolist()],
+                "positions": p.positions[vertices],
+                "normals": normals / np.where(length > 0, length, 1.0),
+                "degenerate": degenerate(vertices, totals)[faces],
+                "uvs": p.loop_uvs[loops],
+                "weights": self.dense_weights(p, vertices),
+            }
+
+    def dense_weights(self, p, vertices):
+        # (corners, bones) weights, bones in the order of self.bone_names
+        offsets, bones, values = p.vertex_weights(vertices)
+        rows = np.repeat(np.arange(len(vertices)), np.diff(offsets))
+        dense = np.zeros((len(vertices), len(self.bone_names)), dtype=np.float64)
+        np.add.at(dense, (rows, self.bone_columns[bones]), values)
+        return dense
+
+def largest(a, b):
+    d = np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64))
+    return float(d.max()) if d.size else 0.0
+
+def compare(a, b, tolerances=TOLERANCES):
+    # differences between the Models a and b as a list of messages
+    out = []
+    if a.bone_names != b.bone_names:
+        out.append("bones differ: %d vs %d, first %s" % (len(a.bone_names), len(b.bone_names),
+            next((x for x in zip(a.bone_names, b.bone_names) if x[0] != x[1]), None)))
+        return out
+    if a.bone_parents != b.bone_parents:
+        out.append("bone parents differ")
+    for name, x, y in (("offsets", a.bone_offsets, b.bone_offsets), ("axes", a.bone_axes, b.bone_axes)):
+        d = largest(x, y)
+        if d > tolerances["bones"]:
+            out.append("bone %s differ by %g" % (name, d))
+
+    if sorted(a.objects) != sorted(b.objects):
+        out.append("objects differ: %s vs %s" % (sorted(a.objects), sorted(b.objects)))
+        return out
+    for name in sorted(a.objects):
+        x = a.objects[name]
+        y = b.objects[name]
+        if not np.array_equal(x["totals"], y["totals"]):
+            out.append("%s: faces differ, %d vs %d" % (name, len(x["totals"]), len(y["totals"])))
+            continue
+        if x["materials"] != y["materials"]:
+            out.append("%s: face materials differ" % (name))
+        for key in ("positions", "weights"):
+            d = largest(x[key], y[key])
+            if d > tolerances[key]:
+                out.append("%s: %s differ by %g" % (name, key, d))
+        keep = ~(x["degenerate"] | y["degenerate"])
+        d = largest(x["normals"][keep], y["normals"][keep])
+        if d > tolerances["normals"]:
+            out.append("%s: normals differ by %g" % (name, d))
+        # uvs are compared as Blender shows them, whole tiles apart are the same
+        d = np.abs(parser.convert_uvs(x["uvs"]).astype(np.float64) - parser.convert_uvs(y["uvs"]))
+        d = np.minimum(d, 1.0 - d)
+        if d.size and d.max() > tolerances["uvs"]:
+            out.append("%s: uvs differ by %g" % (name, d.max()))
+    return out
+
+def read(path):
+    p = parser.Parser()
+    p.read_file(path)
+    return p
+
+def check(path, repeat=1):
+    # round trip of one file, returns (differences, stages of a benchmark.Report)
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+    report = benchmark.Report()
+    lines = benchmark.count_lines(path)
+    p = report.run("parse", lines, "lines", repeat, read, path)
+    fd, out = tempfile.mkstemp(suffix=".xmodel_export")
+    os.close(fd)
+    try:
+        if bpy is None:
+            report.run("write", len(p.face_loop_start), "faces", repeat, write_parsed, p, out)
+        else:
+            report.timed("import_export", len(p.face_loop_start), "faces", export_blender, path, out)
+        q = report.run("reparse", benchmark.count_lines(out), "lines", repeat, read, out)
+    finally:
+        os.remove(out)
+    return compare(Model(p), Model(q)), report.stages
+
+def slower(stages, baseline, slowdown=SLOWDOWN):
+    # stages whose throughput fell more than slowdown below the baseline
+    out = []
+    for name, s in stages.items():
+        base = baseline.get(name)
+        if base is None or not s["per_second"]:
+            continue
+        if s["per_second"] < base * (1.0 - slowdown):
+            out.append("%s %.0f %s/s, baseline %.0f (%.0f%% slower)" % (
+                name, s["per_second"], s["unit"], base, 100.0 * (1.0 - s["per_second"] / base)))
+    return out
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    ap = argparse.ArgumentParser(description="Round-trip and throughput checks of the parser and exporter")
+    ap.add_argument("files", nargs="*", help="files to check, the synthetic cases are used when empty")
+    ap.add_argument("--repeat", type=int, default=3, help="runs of the timed stages, the best one counts")
+    ap.add_argument("--baseline", default=BASELINE, help="JSON with the throughput to compare to, written when missing")
+    ap.add_argument("--save-baseline", help="write the throughput of this run to this file")
+    ap.add_argument("--slowdown", type=float, default=SLOWDOWN, help="fraction of the baseline throughput a stage may lose")
+    args = ap.parse_args(argv)
+
+    cases = {os.path.basename(path): path for path in args.files}
+    temporary = []
+    if not cases:
+        for name, config in CASES.items():
+            fd, path = tempfile.mkstemp(suffix=".xmodel_export")
+            os.close(fd)
+            temporary.append(path)
+            synthetic.generate(path, **config)
+            cases[name] = path
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    elif not args.save_baseline:
+        args.save_baseline = args.baseline
+
+    failed = 0
+    results = {}
+    try:
+        for name, path in cases.items():
+            try:
+                differences, stages = check(path, args.repeat)
+            except Exception as e:
+                differences, stages = ["%s: %s" % (type(e).__name__, str(e))], {}
+            results[name] = {stage: s["per_second"] for stage, s in stages.items()}
+            slow = slower(stages, baseline.get(name, {}), args.slowdown)
+            ok = not differences and not slow
+            failed += not ok
+            print("%-6s %s" % ("ok" if ok else "FAIL", name))
+            for stage, s in stages.items():
+                print("  %-14s %8.3fs %12.0f %s/s" % (stage, s["seconds"], s["per_second"] or 0, s["unit"]))
+            for message in differences + slow:
+                print("  %s" % (message))
+    finally:
+        for path in temporary:
+            os.remove(path)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print("baseline written to %s" % (args.save_baseline))
+    print("%d checked, %d failed" % (len(cases), failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# The NUMVERTS and NUMFACES sections of meshes given as arrays, and the cache
+# that lets an incremental export reuse the text of unchanged meshes. Nothing
+# here needs bpy: the Exporter feeds it the arrays of evaluated Blender meshes,
+# roundtrip.py the objects of a parsed file.
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from . import dedup
+from . import formatting
+from . import influences
+from . import profiling
+
+def merge_vertices(co, weights, loop_vertices, loop_starts, loop_totals, epsilon):
+    keep, remap = dedup.dedup(co, weights=weights, epsilon=epsilon)
+    corners = loop_vertices[influences.ranges(loop_starts, loop_totals)]
+    # meshes with a face that would collapse are written unmerged
+    if dedup.distinct_corners(remap[corners], loop_totals) != dedup.distinct_corners(corners, loop_totals):
+        return np.arange(len(co)), np.arange(len(co))
+    return keep, remap
+
+def fingerprint(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for p in parts:
+        if isinstance(p, np.ndarray):
+            h.update(("%s%r" % (p.dtype, p.shape)).encode("utf-8"))
+            h.update(np.ascontiguousarray(p).data)
+        else:
+            h.update(repr(p).encode("utf-8"))
+    return h.digest()
+
+# vertex numbers (VERT) and object numbers (TRI) at the start of a line
+SECTION_NUMBER = re.compile(r"^(VERT|TRI) (\d+)", re.M)
+
+class Section():
+    # a formatted VERT or TRI section, written again as it is or, for a mesh
+    # that now starts at another vertex number or has another object number,
+    # from a template with its vertex and object numbers taken out. The
+    # template is only built the first time the numbers move
+    def __init__(self, text, total, mesh_index):
+        self.source = text
+        self.total = total
+        self.mesh_index = mesh_index
+        self.template = None
+        self.size = len(text)
+    
+    def build(self):
+        parts = SECTION_NUMBER.split(self.source.replace("%", "%%"))
+        keywords = parts[1::3]
+        self.template = parts[0] + "".join(k + " %d" + l for k, l in zip(keywords, parts[3::3]))
+        self.vertex = np.array([k == "VERT" for k in keywords], dtype=bool)
+        numbers = np.fromiter(map(int, parts[2::3]), dtype=np.int64, count=len(keywords))
+        self.numbers = numbers - np.where(self.vertex, self.total, self.mesh_index)
+    
+    def text(self, total, mesh_index):
+        if total == self.total and mesh_index == self.mesh_index:
+            return self.source
+        if self.template is None:
+            self.build()
+        return self.template % tuple((self.numbers + np.where(self.vertex, total, mesh_index)).tolist())
+
+class SectionEntry():
+    def __init__(self, key, keep, remap, numfaces):
+        self.key = key
+        self.keep = keep
+        self.remap = remap
+        self.numfaces = numfaces
+        self.state = None # object, mesh, groups and settings it was extracted with
+        self.slots = None # material entry of every slot
+        self.total = None # first vertex number of the mesh in this export
+        self.mesh_index = None
+        self.vertices = None # Sections
+        self.faces = None
+
+class SectionCache():
+    # formatted VERT and TRI sections of every mesh of the last export to path,
+    # keyed by object name and checked against a fingerprint of the mesh content.
+    # Sections beyond max_bytes of text are not kept.
+    # While the update handlers of export.py are installed (tracking) the objects and
+    # meshes with geometry or transform updates since the last export are
+    # known, the others are reused without being evaluated at all
+    def __init__(self, max_bytes=1 << 28):
+        self.path = None
+        self.entries = {}
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.tracking = False
+        self.dirty = set() # (id_type, name)
+        self.everything = True # set by loading a file or undo
+    
+    def clean(self, ob, state):
+        # the entry of ob when nothing of it changed since it was written
+        if not self.tracking or self.everything:
+            return None
+        if ('OBJECT', ob.name) in self.dirty or ('MESH', ob.data.name) in self.dirty:
+            return None
+        e = self.entries.get(ob.name)
+        if e is None or e.state != state or e.vertices is None or e.faces is None:
+            return None
+        return e
+    
+    def begin(self, path):
+        path = os.path.abspath(path)
+        if path != self.path:
+            self.path = path
+            self.entries = {}
+        self.size = 0
+    
+    def keep(self, section):
+        # section if there is still room for it, None otherwise
+        if section is None or self.size + section.size > self.max_bytes:
+            return None
+        self.size += section.size
+        return section
+    
+    def get(self, name, key):
+        e = self.entries.get(name)
+        if e is None or e.key != key:
+            return None
+        return e
+    
+    def replace(self, entries):
+        # drops meshes that were not part of this export
+        self.entries = entries
+        self.dirty = set()
+        self.everything = False
+
+class MeshWriter():
+    def __init__(self, merge_vertices=True, epsilon=dedup.DEFAULT_EPSILON, cache=None, jobs=1):
+        # merge_vertices writes vertices with the same position and weights once,
+        # with a SectionCache unchanged meshes reuse the text of the last export,
+        # jobs > 1 (0 for every cpu) formats large exports in worker processes
+        self.merge_vertices = merge_vertices
+        self.epsilon = epsilon
+        self.cache = cache
+        self.jobs = jobs
+    
+    def write_texts(self, w, texts, cached, total, mesh_index):
+        # writes the chunks of one section, or the cached Section rebased onto
+        # total and mesh_index. Returns the Section to keep in the cache
+        if cached is not None:
+            w.write(cached.text(total, mesh_index))
+            return self.cache.keep(cached)
+        if self.cache is None:
+            for t in texts:
+                w.write(t)
+            return None
+        text = "".join(texts)
+        w.write(text)
+        if self.cache.size + len(text) > self.cache.max_bytes:
+            return None
+        return self.cache.keep(Section(text, total, mesh_index))
+    
+    def write_meshes(self, w, names, arrays, weights, face_materials, reused=None):
+        # arrays holds (co, normals, loop_vertices, loop_starts, loop_totals, uvs)
+        # of every mesh, with Blender uvs, weights its (offsets, bones, weights)
+        # and face_materials the MATERIAL of every face. Meshes with an entry in
+        # reused are written from its sections and need no arrays. Returns the
+        # SectionEntry of every mesh, entry.keep are the vertices written and
+        # entry.remap maps the mesh vertices to them
+        if reused is None:
+            reused = [None] * len(names)
+        entries = []
+        with profiling.stage("dedup", sum(len(a[0]) for a in arrays if a is not None)):
+            for name, a, vw, fm, entry in zip(names, arrays, weights, face_materials, reused):
+                if entry is None:
+                    co, normals, loop_vertices, loop_starts, loop_totals, uvs = a
+                    key = None
+                    if self.cache is not None:
+                        key = fingerprint(co, normals, loop_vertices, loop_starts, loop_totals, uvs, *vw,
+                            fm, self.merge_vertices, self.epsilon)
+                        entry = self.cache.get(name, key)
+                    if entry is None:
+                        keep = remap = np.arange(len(co))
+                        if self.merge_vertices:
+                            keep, remap = merge_vertices(co, vw, loop_vertices, loop_starts, loop_totals, self.epsilon)
+                        entry = SectionEntry(key, keep, remap, len(loop_totals))
+                        profiling.count("merged_vertices", len(co) - len(keep))
+                entries.append(entry)
+        numfaces = sum(e.numfaces for e in entries)
+        numverts = sum(len(e.keep) for e in entries)
+        w.write("NUMVERTS %d\n" % (numverts))
+        
+        # cached sections are rebased onto the vertex and object numbers of
+        # this export, the others are handed to the formatter before anything
+        # is written so workers can run ahead of the writes
+        vertex_texts = []
+        face_texts = []
+        work = 0
+        total = 0
+        for mesh_index, e in enumerate(entries):
+            if e.vertices is None:
+                work += len(e.keep)
+            if e.faces is None:
+                work += e.numfaces
+            e.total = total
+            e.mesh_index = mesh_index
+            total += len(e.keep)
+        
+        with formatting.Formatter(self.jobs, work) as fmt:
+            for a, vw, e in zip(arrays, weights, entries):
+                if e.vertices is not None:
+                    vertex_texts.append(None)
+                    profiling.count("cached_vertices", len(e.keep))
+                else:
+                    vertex_texts.append(fmt.submit(formatting.vertex_chunks(a[0], vw, e.keep, e.total)))
+            for a, fm, e in zip(arrays, face_materials, entries):
+                if e.faces is not None:
+                    face_texts.append(None)
+                    profiling.count("cached_faces", e.numfaces)
+                else:
+                    co, normals, loop_vertices, loop_starts, loop_totals, uvs = a
+                    face_texts.append(fmt.submit(formatting.face_chunks(e.mesh_index, fm, e.remap, normals, loop_vertices, loop_starts, loop_totals, uvs, e.total)))
+            
+            for e, texts in zip(entries, vertex_texts):
+                with profiling.stage("vertices", len(e.keep)):
+                    e.vertices = self.write_texts(w, texts, e.vertices, e.total, e.mesh_index)
+            
+            w.write("NUMFACES %d\n" % (numfaces))
+            for e, texts in zip(entries, face_texts):
+                with profiling.stage("faces", e.numfaces):
+                    e.faces = self.write_texts(w, texts, e.faces, e.total, e.mesh_index)
+        
+        return entries
@@ -0,0 +1,76 @@
+# Deterministic generator for synthetic VERSION 6 .xmodel_export files, used by
+# the benchmarks. The same arguments and seed always produce the same file.
+
+import math
+import random
+
+from .formatting import MATERIAL_PROPERTIES
+
+def unit_vector(r):
+    z = r.uniform(-1.0, 1.0)
+    a = r.uniform(0.0, 2.0 * math.pi)
+    s = math.sqrt(1.0 - z * z)
+    return (s * math.cos(a), s * math.sin(a), z)
+
+def generate(path, bones=64, vertices=10000, triangles=20000, influences=4, objects=1, materials=1, seed=0):
+    if bones < 1 or vertices < 3 * objects or objects < 1 or materials < 1:
+        raise ValueError("need at least one bone, material and object and three vertices per object")
+    influences = max(1, min(influences, bones))
+    r = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        out = []
+        out.append("// synthetic xmodel_export, seed %d\n" % (seed))
+        out.append("MODEL\nVERSION 6\n\n")
+
+        out.append("NUMBONES %d\n" % (bones))
+        for i in range(bones):
+            parent = -1 if i == 0 else r.randrange(i)
+            out.append("BONE %d %d \"bone_%d\"\n" % (i, parent, i))
+        out.append("\n")
+        for i in range(bones):
+            out.append("BONE %d\nOFFSET %f, %f, %f\nSCALE 1.000000, 1.000000, 1.000000\n" % (
+                (i,) + tuple(r.uniform(-50.0, 50.0) for k in range(3))))
+            out.append("X 1.000000, 0.000000, 0.000000\nY 0.000000, 1.000000, 0.000000\nZ 0.000000, 0.000000, 1.000000\n\n")
+        f.write("".join(out))
+
+        f.write("NUMVERTS %d\n" % (vertices))
+        out = []
+        for i in range(vertices):
+            weights = [r.random() + 0.05 for k in range(influences)]
+            total = sum(weights)
+            out.append("VERT %d\nOFFSET %f, %f, %f\nBONES %d\n" % (
+                (i,) + tuple(r.uniform(-50.0, 50.0) for k in range(3)) + (influences,)))
+            for b, w in zip(r.sample(range(bones), influences), weights):
+                out.append("BONE %d %f\n" % (b, w / total))
+            out.append("\n")
+            if len(out) >= 1 << 14:
+                f.write("".join(out))
+                out = []
+        f.write("".join(out))
+
+        # each object gets its own contiguous range of vertices and triangles
+        f.write("NUMFACES %d\n" % (triangles))
+        out = []
+        for o in range(objects):
+            v0 = vertices * o // objects
+            v1 = vertices * (o + 1) // objects
+            t0 = triangles * o // objects
+            t1 = triangles * (o + 1) // objects
+            for t in range(t0, t1):
+                out.append("TRI %d %d 0 0\n" % (o, o % materials))
+                for k in range(3):
+                    out.append("VERT %d\nNORMAL %f %f %f\nCOLOR 1.000000 1.000000 1.000000 1.000000\nUV 1 %f %f\n" % (
+                        (r.randrange(v0, v1),) + unit_vector(r) + (r.random(), r.random())))
+                if len(out) >= 1 << 14:
+                    f.write("".join(out))
+                    out = []
+        f.write("".join(out))
+
+        f.write("\nNUMOBJECTS %d\n" % (objects))
+        for o in range(objects):
+            f.write("OBJECT %d \"object_%d\"\n" % (o, o))
+        f.write("\nNUMMATERIALS %d\n" % (materials))
+        for m in range(materials):
+            f.write("MATERIAL %d \"material_%d\" \"Phong\" \"\"\n" % (m, m))
+            f.write(MATERIAL_PROPERTIES)
+        f.write("\n")
@@ -0,0 +1,16 @@
+import shutil
+
+import pytest
+
+from .. import batch
+from .test_roundtrip import FIXTURE
+
+@pytest.mark.parametrize("jobs", [0, None, 1, 2])
+def test_jobs(tmp_path, jobs):
+    files = []
+    for name in ("a", "b"):
+        path = str(tmp_path / ("%s.xmodel_export" % (name)))
+        shutil.copy(FIXTURE, path)
+        files.append(path)
+    results = batch.run(files, jobs)
+    assert [r["ok"] for r in results] == [True, True]
@@ -0,0 +1,64 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+from .. import formatting
+from .. import roundtrip
+from .. import synthetic
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "cube.xmodel_export")
+
+@pytest.mark.parametrize("name", sorted(roundtrip.CASES))
+def test_synthetic_cases(tmp_path, name):
+    path = str(tmp_path / ("%s.xmodel_export" % (name)))
+    synthetic.generate(path, **roundtrip.CASES[name])
+    differences, stages = roundtrip.check(path)
+    assert differences == []
+    assert all(s["per_second"] for s in stages.values())
+
+def test_fixture():
+    differences, stages = roundtrip.check(FIXTURE)
+    assert differences == []
+
+def test_fixture_written_like_the_exporter(tmp_path):
+    # the fixture comes from the Exporter, writing it back changes nothing
+    out = str(tmp_path / "cube.xmodel_export")
+    roundtrip.write_parsed(roundtrip.read(FIXTURE), out)
+    with open(FIXTURE, "r", encoding="utf-8") as a, open(out, "r", encoding="utf-8") as b:
+        assert a.read() == b.read()
+
+def test_compare_finds_differences():
+    p = roundtrip.read(FIXTURE)
+    a = roundtrip.Model(p)
+    b = roundtrip.Model(p)
+    b.objects["cube"]["positions"] = b.objects["cube"]["positions"] + 1e-3
+    b.objects["cube"]["weights"] = b.objects["cube"]["weights"][:, ::-1]
+    b.bone_axes = b.bone_axes * -1.0
+    assert roundtrip.compare(a, a) == []
+    differences = roundtrip.compare(a, b)
+    assert any("positions" in d for d in differences)
+    assert any("weights" in d for d in differences)
+    assert any("bone axes" in d for d in differences)
+
+def test_slower():
+    stages = {
+        "parse": {"seconds": 1.0, "per_second": 700.0, "unit": "lines"},
+        "write": {"seconds": 1.0, "per_second": 1000.0, "unit": "faces"},
+    }
+    baseline = {"parse": 1000.0, "write": 1000.0, "reparse": 1000.0}
+    slow = roundtrip.slower(stages, baseline)
+    assert len(slow) == 1 and slow[0].startswith("parse")
+    assert roundtrip.slower(stages, baseline, 0.5) == []
+
+def test_write_bones():
+    out = io.StringIO()
+    w = formatting.BlockWriter(out)
+    axes = np.array([[[1, 0, 0], [0, 0, 1], [0, -1, 0]]], dtype=np.float64)
+    formatting.write_bones(w, ["root"], [-1], [[0.5, 0, 0]], axes)
+    w.flush()
+    assert out.getvalue() == (
+        "NUMBONES 1\nBONE 0 -1 \"root\"\n\n"
+        "BONE 0\nOFFSET 0.500000, 0.000000, 0.000000\nSCALE 1.000000, 1.000000, 1.000000\n"
+        "X 1.000000, 0.000000, 0.000000\nY 0.000000, 0.000000, 1.000000\nZ 0.000000, -1.000000, 0.000000\n\n")
@@ -0,0 +1,95 @@
+import numpy as np
+
+from .. import formatting
+from .. import influences
+from .. import profiling
+from .. import roundtrip
+from .. import sections
+from .. import synthetic
+from .test_roundtrip import FIXTURE
+
+def read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def test_section_rebase():
+    co = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float64)
+    weights = (np.array([0, 1, 2, 3]), np.array([0, 1, 0]), np.ones(3))
+    keep = np.arange(3)
+    def text(total):
+        return "".join(fn(*args) for fn, args in formatting.vertex_chunks(co, weights, keep, total))
+    s = sections.Section(text(10), 10, 2)
+    assert s.text(10, 2) == text(10)
+    assert s.text(0, 0) == text(0)
+    assert s.text(100, 5) == text(100)
+
+def test_cache_rebases_objects(tmp_path):
+    path = str(tmp_path / "source.xmodel_export")
+    synthetic.generate(path, bones=8, vertices=600, triangles=900, influences=3, objects=3, materials=2, seed=3)
+    p = roundtrip.read(path)
+    out = str(tmp_path / "out.xmodel_export")
+    fresh = str(tmp_path / "fresh.xmodel_export")
+    writer = sections.MeshWriter(cache=sections.SectionCache())
+    # all objects, then without the first one so the others move to other
+    # vertex and object numbers, then all of them again
+    moved = sum(len(o.face_indices) for o in p.objects[1:])
+    for objects, cached in ((p.objects, 0), (p.objects[1:], moved), (p.objects, moved)):
+        prof = profiling.create(True)
+        with profiling.enabled(prof):
+            roundtrip.write_parsed(p, out, writer, objects)
+        roundtrip.write_parsed(p, fresh, sections.MeshWriter(), objects)
+        assert read_text(out) == read_text(fresh)
+        assert prof.counts.get("cached_faces", 0) == cached
+    q = roundtrip.read(out)
+    assert roundtrip.compare(roundtrip.Model(p), roundtrip.Model(q)) == []
+
+def test_cache_misses_changed_objects(tmp_path):
+    p = roundtrip.read(FIXTURE)
+    out = str(tmp_path / "out.xmodel_export")
+    writer = sections.MeshWriter(cache=sections.SectionCache())
+    roundtrip.write_parsed(p, out, writer)
+    p.positions[0] += 1.0
+    prof = profiling.create(True)
+    with profiling.enabled(prof):
+        roundtrip.write_parsed(p, out, writer)
+    assert not "cached_faces" in prof.counts
+    assert roundtrip.compare(roundtrip.Model(p), roundtrip.Model(roundtrip.read(out))) == []
+
+def split(p, path):
+    # the fixture written with a vertex of its own for every face corner
+    (co, normals, loop_vertices, starts, totals, uvs), vw, fm = roundtrip.object_arrays(p, p.objects[0])
+    corners = (co[loop_vertices], normals, np.arange(len(loop_vertices)), starts, totals, uvs)
+    with open(path, "w", encoding="utf-8") as f:
+        w = formatting.BlockWriter(f)
+        w.write(formatting.HEADER)
+        formatting.write_bones(w, p.bone_names, p.bone_parents.tolist(), p.bone_offsets, p.bone_axes)
+        sections.MeshWriter(merge_vertices=False).write_meshes(w, [p.objects[0].name], [corners],
+            [influences.take(vw, loop_vertices)], [fm])
+        w.write("\n")
+        formatting.write_objects(w, [(0, p.objects[0].name)])
+        formatting.write_materials(w, [(m.index, m.name, m.texture_path) for m in p.materials])
+        w.flush()
+
+def test_merge_vertices(tmp_path):
+    p = roundtrip.read(FIXTURE)
+    path = str(tmp_path / "split.xmodel_export")
+    split(p, path)
+    s = roundtrip.read(path)
+    assert len(s.positions) == len(s.loop_vertices) > len(p.positions)
+    out = str(tmp_path / "merged.xmodel_export")
+    roundtrip.write_parsed(s, out)
+    q = roundtrip.read(out)
+    assert len(q.positions) == len(p.positions)
+    assert roundtrip.compare(roundtrip.Model(s), roundtrip.Model(q)) == []
+
+def test_merge_keeps_faces():
+    # merging the first two vertices would collapse the triangle, nothing merges
+    co = np.array([[0, 0, 0], [0, 0, 0], [1, 0, 0], [2, 0, 0], [2, 0, 0]], dtype=np.float64)
+    weights = (np.arange(6), np.zeros(5, dtype=np.int64), np.ones(5))
+    starts = np.array([0])
+    totals = np.array([3])
+    keep, remap = sections.merge_vertices(co, weights, np.array([0, 1, 2]), starts, totals, 1e-5)
+    assert keep.tolist() == [0, 1, 2, 3, 4]
+    keep, remap = sections.merge_vertices(co, weights, np.array([0, 2, 3]), starts, totals, 1e-5)
+    assert keep.tolist() == [0, 2, 3]
+    assert remap.tolist() == [0, 0, 1, 2, 2]
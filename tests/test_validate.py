@@ -0,0 +1,72 @@
+import numpy as np
+
+from .. import parser
+from .. import validate
+from .test_roundtrip import FIXTURE
+
+# a rig without meshes, nothing is weighted
+RIG = """MODEL
+VERSION 6
+
+NUMBONES 2
+BONE 0 -1 "root"
+BONE 1 0 "tip"
+
+BONE 0
+OFFSET 0.000000, 0.000000, 0.000000
+SCALE 1.000000, 1.000000, 1.000000
+X 1.000000, 0.000000, 0.000000
+Y 0.000000, 1.000000, 0.000000
+Z 0.000000, 0.000000, 1.000000
+
+BONE 1
+OFFSET 0.000000, 0.000000, 1.000000
+SCALE 1.000000, 1.000000, 1.000000
+X 1.000000, 0.000000, 0.000000
+Y 0.000000, 1.000000, 0.000000
+Z 0.000000, 0.000000, 1.000000
+
+NUMVERTS 0
+NUMFACES 0
+
+NUMOBJECTS 0
+
+NUMMATERIALS 0
+"""
+
+def read(path, sections=None, objects=None):
+    p = parser.Parser()
+    p.read_file(path, sections, objects)
+    return p
+
+def test_fixture():
+    assert validate.validate(read(FIXTURE)) == []
+
+def test_skeleton_only():
+    p = read(FIXTURE, sections=("bones",))
+    assert len(p.positions) == 0
+    assert validate.validate(p) == []
+
+def test_no_faces_of_object():
+    p = read(FIXTURE, objects=[99])
+    assert len(p.face_loop_start) == 0
+    assert validate.validate(p) == []
+
+def test_no_influences(tmp_path):
+    path = tmp_path / "rig.xmodel_export"
+    path.write_text(RIG, encoding="utf-8")
+    p = read(str(path))
+    assert len(p.weight_values) == 0
+    assert validate.validate(p) == []
+
+def test_problems_located(tmp_path):
+    text = open(FIXTURE, "r", encoding="utf-8").read()
+    path = tmp_path / "bad.xmodel_export"
+    path.write_text(text.replace("NUMBONES 2\nBONE 0 -1 \"root\"\nBONE 1 0 \"tip\"", "NUMBONES 2\nBONE 0 -1 \"root\"\nBONE 1 5 \"tip\""), encoding="utf-8")
+    p = read(str(path))
+    p.positions[3] = np.nan
+    problems = validate.locate(str(path), validate.validate(p))
+    assert [x.check for x in problems] == ["bone_parent", "finite"]
+    assert problems[0].line == 6
+    assert problems[1].line is not None
+    assert validate.validate(p, fail_fast=True)[0].check == "bone_parent"
@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+from .. import formatting
+from .. import workers
+
+def square(x):
+    return x * x
+
+def die(x):
+    # only workers die, the redo in the test process returns
+    if multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return x
+
+def test_count():
+    assert workers.count(0) == workers.count(None) == (os.cpu_count() or 1)
+    assert workers.count(3) == 3
+
+def test_pool():
+    with workers.Pool(2) as pool:
+        pending = [pool.submit(square, x) for x in range(5)]
+        assert [p() for p in pending] == [0, 1, 4, 9, 16]
+
+def test_dead_worker_redone_here():
+    with workers.Pool(1) as pool:
+        pending = [pool.submit(die, x) for x in range(3)]
+        assert [p() for p in pending] == [0, 1, 2]
+        # a broken pool runs what comes after in this process
+        assert pool.submit(square, 3)() == 9
+
+def test_formatter_jobs():
+    chunks = [(square, (x,)) for x in range(4)]
+    for jobs in (0, 1, 2):
+        with formatting.Formatter(jobs, formatting.PARALLEL_MIN_ROWS) as fmt:
+            assert list(fmt.submit(iter(chunks))) == [0, 1, 4, 9]
@@ -0,0 +1,181 @@
+# Checks on a parsed file, run between parsing and building the scene.
+#
+# Every check works on the Parser's arrays, so a file is checked in a few
+# numpy passes. A Problem names the check, how many items fail it and the
+# first of them; locate() then finds the file line of that item by reading
+# the file again up to it, which only failing files pay for.
+#
+# ERROR problems would break the import (indices out of range, NaN values),
+# WARNING ones import fine but point at a broken exporter.
+
+import numpy as np
+
+from . import records
+
+ERROR = 'ERROR'
+WARNING = 'WARNING'
+
+WEIGHT_TOLERANCE = 1e-3
+
+ITEMS = {"bones": "bone", "poses": "bone", "vertices": "vertex", "faces": "face"}
+
+class Problem():
+    def __init__(self, check, severity, message, count=1, kind=None, index=None):
+        # kind and index name the first failing item for locate(): the n-th of
+        # "bones", "vertices" or "faces", the pose of bone n for "poses", or
+        # with index None the NUM* line of that section
+        self.check = check
+        self.severity = severity
+        self.message = message
+        self.count = count
+        self.kind = kind
+        self.index = index
+        self.line = None
+
+    def __str__(self):
+        where = "" if self.line is None else "line %d: " % (self.line)
+        more = "" if self.count <= 1 else " (%d in all)" % (self.count)
+        return "%s%s%s" % (where, self.message, more)
+
+    def to_dict(self):
+        return {
+            "check": self.check,
+            "severity": self.severity,
+            "message": self.message,
+            "count": self.count,
+            "line": self.line,
+        }
+
+class ValidationError(Exception):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("; ".join(str(p) for p in problems))
+
+def first(mask):
+    return int(np.flatnonzero(mask)[0])
+
+def check_counts(p):
+    # NUM* headers against what was read, sections that were skipped or
+    # filtered are not checked
+    found = (
+        ("bones", "NUMBONES", p.numbones, len(p.bone_names)),
+        ("vertices", "NUMVERTS", p.numverts, len(p.positions)),
+        ("faces", "NUMFACES", p.numfaces, len(p.face_loop_start)),
+        ("objects", "NUMOBJECTS", p.numobjects, len(p.object_names)),
+        ("materials", "NUMMATERIALS", p.nummaterials, len(p.materials)),
+    )
+    for section, keyword, header, n in found:
+        if header == -1 or (p.sections is not None and not section in p.sections):
+            continue
+        if section == "faces" and p.object_filter is not None:
+            continue
+        if header != n:
+            yield Problem("count", WARNING, "%s %d but %d read" % (keyword, header, n), abs(header - n), section)
+
+def check_indices(p):
+    nb = len(p.bone_names)
+    bad = (p.bone_parents < -1) | (p.bone_parents >= nb)
+    if bad.any():
+        i = first(bad)
+        yield Problem("bone_parent", ERROR, "bone %d has parent %d, there are %d bones" % (i, p.bone_parents[i], nb), int(bad.sum()), "bones", i)
+
+    bad = (p.weight_bones < 0) | (p.weight_bones >= nb)
+    if bad.any():
+        w = first(bad)
+        v = int(np.searchsorted(p.weight_offsets, w, side="right")) - 1
+        yield Problem("weight_bone", ERROR, "vertex %d is weighted to bone %d, there are %d bones" % (v, p.weight_bones[w], nb), int(bad.sum()), "vertices", v)
+
+    nv = len(p.positions)
+    if not "vertices" in (p.sections or records.SECTIONS):
+        return
+    bad = (p.loop_vertices < 0) | (p.loop_vertices >= nv)
+    if bad.any():
+        l = first(bad)
+        f = int(np.searchsorted(p.face_loop_start, l, side="right")) - 1
+        yield Problem("face_vertex", ERROR, "face %d uses vertex %d, there are %d vertices" % (f, p.loop_vertices[l], nv), int(bad.sum()), "faces", f)
+
+def check_faces(p):
+    bad = p.face_loop_total != 3
+    if bad.any():
+        f = first(bad)
+        yield Problem("triangles", WARNING, "face %d has %d corners" % (f, p.face_loop_total[f]), int(bad.sum()), "faces", f)
+
+    if p.nummaterials != -1 and len(p.face_materials):
+        bad = ~np.isin(p.face_materials, [m.index for m in p.materials])
+        if bad.any():
+            f = first(bad)
+            yield Problem("face_material", WARNING, "face %d uses MATERIAL %d, which is not defined" % (f, p.face_materials[f]), int(bad.sum()), "faces", f)
+
+def check_values(p):
+    # NaN or infinite numbers, the first of each array
+    arrays = (
+        ("positions", p.positions, "vertices", None),
+        ("weights", p.weight_values, "vertices", p.weight_offsets),
+        ("normals", p.loop_normals, "faces", p.face_loop_start),
+        ("uvs", p.loop_uvs, "faces", p.face_loop_start),
+        ("bone offsets", p.bone_offsets, "poses", None),
+        ("bone axes", p.bone_axes, "poses", None),
+    )
+    for name, a, kind, offsets in arrays:
+        # skipped sections and filtered objects leave arrays empty
+        if a.size == 0:
+            continue
+        bad = ~np.isfinite(a.reshape(len(a), -1)).all(axis=1)
+        if bad.any():
+            i = first(bad)
+            if offsets is not None:
+                i = int(np.searchsorted(offsets, i, side="right")) - 1
+            yield Problem("finite", ERROR, "%s of %s %d are not finite" % (name, ITEMS[kind], i), int(bad.sum()), kind, i)
+
+def check_weights(p, tolerance=WEIGHT_TOLERANCE):
+    counts = np.diff(p.weight_offsets)
+    if len(counts) == 0:
+        return
+    rows = np.repeat(np.arange(len(counts)), counts)
+    sums = np.bincount(rows, p.weight_values.astype(np.float64), minlength=len(counts))
+    bad = np.abs(sums - 1.0) > tolerance
+    if bad.any():
+        v = first(bad)
+        yield Problem("weight_sum", WARNING, "weights of vertex %d sum to %g" % (v, sums[v]), int(bad.sum()), "vertices", v)
+
+CHECKS = (check_counts, check_indices, check_values, check_faces, check_weights)
+
+def validate(p, fail_fast=False):
+    # list of Problems of the parsed file p, only the first with fail_fast
+    problems = []
+    for check in CHECKS:
+        for problem in check(p):
+            problems.append(problem)
+            if fail_fast:
+                return problems
+    return problems
+
+def locate(path, problems, sections=None, objects=None):
+    # fills in Problem.line by reading path again, with the filters p was read
+    # with, up to the last item asked for
+    wanted = {}
+    for problem in problems:
+        if problem.kind is not None:
+            wanted.setdefault((problem.kind, problem.index), []).append(problem)
+    kinds = {
+        records.BoneDefinition: "bones",
+        records.Vertex: "vertices",
+        records.Triangle: "faces",
+    }
+    seen = dict.fromkeys(kinds.values(), 0)
+    for r in records.records(path, sections, objects):
+        if not wanted:
+            break
+        if type(r) is records.Count:
+            key = (r.section, None)
+        elif type(r) is records.BonePose:
+            key = ("poses", r.index)
+        else:
+            kind = kinds.get(type(r))
+            if kind is None:
+                continue
+            key = (kind, seen[kind])
+            seen[kind] += 1
+        for problem in wanted.pop(key, ()):
+            problem.line = r.line
+    return problems
@@ -0,0 +1,48 @@
+# Worker processes of the exporter's Formatter, parser.read_files and batch.
+#
+# Workers are started with spawn rather than fork, forking a running Blender
+# is not safe. Work handed to a Pool is redone in this process when its
+# worker died (not when it raised), so a killed worker does not fail the run.
+
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+
+def count(jobs):
+    # jobs 0 or None means one worker per cpu
+    return jobs or os.cpu_count() or 1
+
+def executor(jobs):
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"))
+
+def result(future, fn, args):
+    try:
+        return future.result()
+    except concurrent.futures.process.BrokenProcessPool:
+        return fn(*args)
+
+class Pool():
+    def __init__(self, jobs):
+        self.executor = executor(jobs)
+
+    def submit(self, fn, *args):
+        # a function returning fn(*args), from a worker while the pool works
+        if self.executor is not None:
+            try:
+                return functools.partial(result, self.executor.submit(fn, *args), fn, args)
+            except concurrent.futures.process.BrokenProcessPool:
+                self.close()
+        return functools.partial(fn, *args)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False